@@ -1,56 +1,2195 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak, HRFlowable, KeepTogether
-from reportlab.lib.units import inch, cm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from PIL import Image as PILImage
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, IndexModel, ASCENDING, DESCENDING
+from pymongo import monitoring
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
 from dotenv import load_dotenv
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+import atexit
 import base64
 import io
 import tempfile
 import random
-import tempfile
+import hashlib
+import json
+import math
+import threading
+import time
+import shutil
+import copy
+import functools
+import fcntl
+import multiprocessing
+import multiprocessing.util
+import uuid
+import re
+import zipfile
+import click
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# ==================== CHARGEMENT DIFFÉRÉ DE REPORTLAB ET PILLOW ====================
+
+# ReportLab et Pillow représentent l'essentiel du temps d'import du module : ils
+# ne sont chargés qu'au premier rendu PDF ou traitement d'image, pour que les
+# workers qui ne servent que des formulaires ou des redirections démarrent vite.
+_pdf_stack_loaded = False
+
+def load_pdf_stack():
+    """Importe ReportLab et Pillow dans l'espace de noms du module (une seule fois)"""
+    global _pdf_stack_loaded, canvas, A4, letter, colors, getSampleStyleSheet, ParagraphStyle
+    global SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak, HRFlowable, KeepTogether, Flowable
+    global Frame, BaseDocTemplate, PageTemplate, inch, cm, pdfmetrics, TTFont, pdfdoc, PILImage, ImageDraw, ImageOps, PreparedImage, StaticBlock
+    if _pdf_stack_loaded:
+        return
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4, letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak, HRFlowable, KeepTogether, Flowable
+    from reportlab.platypus import Frame, BaseDocTemplate, PageTemplate
+    from reportlab.lib.units import inch, cm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfbase import pdfdoc
+    from PIL import Image as PILImage, ImageDraw, ImageOps
+    PreparedImage = _define_prepared_image()
+    StaticBlock = _define_static_block()
+    _pdf_stack_loaded = True
+
+def needs_pdf_stack(func):
+    """Décorateur des fonctions qui utilisent ReportLab ou Pillow"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        load_pdf_stack()
+        return func(*args, **kwargs)
+    return wrapper
+
+# Charger variables .env
+load_dotenv()
+
+app = Flask(__name__)
+
+# Configurations
+app.config["UPLOAD_FOLDER"] = "static/uploads"
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key")
+# Taille au-delà de laquelle un PDF en cours de rendu est déversé sur disque (0 = toujours en mémoire)
+app.config["PDF_SPOOL_MAX_SIZE"] = int(os.getenv("PDF_SPOOL_MAX_SIZE", 0))
+# Taille maximale (octets) du cache des carnets déjà rendus, par worker
+app.config["PDF_CACHE_MAX_BYTES"] = int(os.getenv("PDF_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Nombre de carnets par page dans les listes
+app.config["CARNETS_PAGE_SIZE"] = int(os.getenv("CARNETS_PAGE_SIZE", 50))
+# Durée de validité (secondes) des compteurs affichés sur la page d'accueil
+app.config["STATS_TTL"] = int(os.getenv("STATS_TTL", 60))
+# Résolution des images intégrées aux PDF et dossier des variantes pré-calculées
+app.config["PDF_IMAGE_DPI"] = int(os.getenv("PDF_IMAGE_DPI", 200))
+app.config["PDF_VARIANT_FOLDER"] = os.getenv("PDF_VARIANT_FOLDER", os.path.join(tempfile.gettempdir(), "carnet-sante-variants"))
+# Taille maximale (octets) des objets images PDF préparés gardés en mémoire, par worker
+app.config["PDF_IMAGE_CACHE_MAX_BYTES"] = int(os.getenv("PDF_IMAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+# Nombre maximal de blocs fixes pré-rendus (en-têtes, pages vierges) gardés en mémoire, par worker
+app.config["PDF_STATIC_CACHE_ENTRIES"] = int(os.getenv("PDF_STATIC_CACHE_ENTRIES", 256))
+# Nombre maximal d'empreintes de fichiers images mémorisées, par worker
+app.config["FILE_DIGEST_CACHE_ENTRIES"] = int(os.getenv("FILE_DIGEST_CACHE_ENTRIES", 4096))
+# Nombre maximal de cartes imposées dans une planche de parties basses (/cartes/planche)
+app.config["PLANCHE_MAX_CARTES"] = int(os.getenv("PLANCHE_MAX_CARTES", 300))
+# Créer les index MongoDB au démarrage de gunicorn, une fois dans le maître (sinon : flask ensure-indexes)
+app.config["MONGO_ENSURE_INDEXES"] = os.getenv("MONGO_ENSURE_INDEXES", "0") == "1"
+# Rendu asynchrone : activé pour toutes les requêtes, ou à la demande avec ?async=1
+app.config["PDF_ASYNC"] = os.getenv("PDF_ASYNC", "0") == "1"
+app.config["PDF_JOB_WORKERS"] = int(os.getenv("PDF_JOB_WORKERS", os.cpu_count() or 1))
+app.config["PDF_JOB_QUEUE_DEPTH"] = int(os.getenv("PDF_JOB_QUEUE_DEPTH", 32))
+app.config["PDF_JOB_FOLDER"] = os.getenv("PDF_JOB_FOLDER", os.path.join(tempfile.gettempdir(), "carnet-sante-jobs"))
+# Nettoyage des fichiers (flask sweep-files) : délai de grâce des uploads non référencés,
+# durée de conservation des tâches et des variantes, taille des lots, période du
+# nettoyage automatique en secondes (0 = désactivé)
+app.config["GC_GRACE_SECONDS"] = int(os.getenv("GC_GRACE_SECONDS", 3600))
+app.config["GC_JOB_TTL"] = int(os.getenv("GC_JOB_TTL", 24 * 3600))
+app.config["GC_VARIANT_TTL"] = int(os.getenv("GC_VARIANT_TTL", 30 * 24 * 3600))
+app.config["GC_BATCH_SIZE"] = int(os.getenv("GC_BATCH_SIZE", 500))
+app.config["GC_INTERVAL"] = int(os.getenv("GC_INTERVAL", 0))
+
+# Mesure des phases des routes de génération (en-tête Server-Timing + log JSON)
+app.config["SERVER_TIMING"] = os.getenv("SERVER_TIMING", "0") == "1"
+# Métriques /metrics : activation, dossier partagé par les workers, période d'écriture (s)
+app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "1") == "1"
+app.config["METRICS_FOLDER"] = os.getenv("METRICS_FOLDER", os.path.join(tempfile.gettempdir(), "carnet-sante-metrics"))
+app.config["METRICS_FLUSH_SECONDS"] = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+# Connexion MongoDB : taille du pool par worker, délais (ms), compression réseau
+# (ex. "zstd,zlib"), niveaux de read/write concern (vides = valeurs du serveur)
+app.config["MONGO_MAX_POOL_SIZE"] = int(os.getenv("MONGO_MAX_POOL_SIZE", 20))
+app.config["MONGO_MIN_POOL_SIZE"] = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"] = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+app.config["MONGO_CONNECT_TIMEOUT_MS"] = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+app.config["MONGO_SOCKET_TIMEOUT_MS"] = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+app.config["MONGO_COMPRESSORS"] = os.getenv("MONGO_COMPRESSORS", "")
+app.config["MONGO_READ_CONCERN"] = os.getenv("MONGO_READ_CONCERN", "")
+app.config["MONGO_WRITE_CONCERN"] = os.getenv("MONGO_WRITE_CONCERN", "")
+
+# ==================== CONNEXION MONGODB ====================
+
+# Client du processus courant. Un client ne doit pas traverser un fork :
+# chaque worker gunicorn (ou processus de rendu) crée le sien.
+_mongo = {"pid": None, "client": None, "db": None}
+_mongo_lock = threading.Lock()
+
+def mongo_client_options():
+    """Options du MongoClient tirées de la configuration"""
+    options = {
+        "maxPoolSize": app.config["MONGO_MAX_POOL_SIZE"],
+        "minPoolSize": app.config["MONGO_MIN_POOL_SIZE"],
+        "serverSelectionTimeoutMS": app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+        "connectTimeoutMS": app.config["MONGO_CONNECT_TIMEOUT_MS"],
+        "socketTimeoutMS": app.config["MONGO_SOCKET_TIMEOUT_MS"],
+        # Aucune connexion n'est ouverte avant la première requête
+        "connect": False,
+    }
+    if app.config["METRICS_ENABLED"]:
+        options["event_listeners"] = [_MongoCommandMetrics()]
+    if app.config["MONGO_COMPRESSORS"]:
+        options["compressors"] = app.config["MONGO_COMPRESSORS"]
+    return options
+
+def mongo_database_options():
+    """Read/write concerns configurés pour la base de l'application"""
+    options = {}
+    if app.config["MONGO_READ_CONCERN"]:
+        options["read_concern"] = ReadConcern(app.config["MONGO_READ_CONCERN"])
+    if app.config["MONGO_WRITE_CONCERN"]:
+        w = app.config["MONGO_WRITE_CONCERN"]
+        options["write_concern"] = WriteConcern(w=int(w) if w.isdigit() else w)
+    return options
+
+def get_db():
+    """Base de données de l'application, avec un client créé à la première utilisation dans ce processus"""
+    pid = os.getpid()
+    if _mongo["pid"] != pid:
+        with _mongo_lock:
+            if _mongo["pid"] != pid:
+                client = MongoClient(os.getenv("MONGO_URI"), **mongo_client_options())
+                _mongo.update(client=client, db=client.get_database(os.getenv("DB_NAME"), **mongo_database_options()),
+                              pid=pid)
+    return _mongo["db"]
+
+class _Database:
+    """Accès à la base (db.carnets, db["factures"]) résolu à chaque appel via get_db()"""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+db = _Database()
+
+# ==================== MÉTRIQUES (FORMAT PROMETHEUS) ====================
+
+# Chaque processus (worker gunicorn ou processus de rendu) cumule ses mesures en
+# mémoire et les recopie régulièrement dans METRICS_FOLDER/<pid>.json ; /metrics
+# additionne les fichiers de tous les processus, y compris ceux qui sont terminés
+# (dont les valeurs sont regroupées dans archive.json) pour que les compteurs ne
+# redescendent jamais.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# nom -> (type, description, intervalles des histogrammes)
+METRICS = {
+    "carnet_http_requests_total": ("counter", "Requêtes HTTP traitées", None),
+    "carnet_http_request_duration_seconds": ("histogram", "Durée des requêtes HTTP par route", DURATION_BUCKETS),
+    "carnet_pdf_render_duration_seconds": ("histogram", "Durée de rendu par générateur PDF", DURATION_BUCKETS),
+    "carnet_pdf_render_bytes_total": ("counter", "Octets de PDF produits par générateur", None),
+    "carnet_pdf_render_errors_total": ("counter", "Rendus PDF en erreur par générateur", None),
+    "carnet_mongo_command_duration_seconds": ("histogram", "Durée des commandes MongoDB", DURATION_BUCKETS),
+    "carnet_mongo_command_errors_total": ("counter", "Commandes MongoDB en erreur", None),
+    "carnet_image_ingest_duration_seconds": ("histogram", "Durée du traitement des images téléversées", DURATION_BUCKETS),
+    "carnet_upload_received_bytes_total": ("counter", "Octets d'images téléversées reçus", None),
+    "carnet_upload_stored_bytes_total": ("counter", "Octets écrits dans le dossier des uploads", None),
+    "carnet_upload_deduplicated_total": ("counter", "Uploads dont le contenu était déjà enregistré", None),
+}
+
+_metrics = {"pid": None, "values": {}, "dirty": False}
+_metrics_lock = threading.Lock()
+
+def _metric_key(name, labels):
+    return name + "|" + ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+
+def _metric_values():
+    """Mesures du processus courant (remises à zéro après un fork) ; appeler sous _metrics_lock"""
+    if _metrics["pid"] != os.getpid():
+        _metrics.update(pid=os.getpid(), values={}, dirty=False)
+        if app.config["METRICS_ENABLED"]:
+            threading.Thread(target=_metrics_flush_loop, name="metrics", daemon=True).start()
+            # Dernière écriture à la sortie du processus (worker recyclé, arrêt) ; les
+            # processus du pool de rendu sortent par os._exit, sans atexit
+            atexit.register(flush_metrics)
+            multiprocessing.util.Finalize(None, flush_metrics, exitpriority=10)
+    _metrics["dirty"] = True
+    return _metrics["values"]
+
+def inc_metric(name, value=1, **labels):
+    """Incrémente un compteur"""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    with _metrics_lock:
+        values = _metric_values()
+        key = _metric_key(name, labels)
+        values[key] = values.get(key, 0) + value
+
+def observe_metric(name, seconds, **labels):
+    """Ajoute une mesure à un histogramme : [compte par intervalle..., somme, nombre]"""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    buckets = METRICS[name][2]
+    with _metrics_lock:
+        values = _metric_values()
+        key = _metric_key(name, labels)
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+def timed(name, **labels):
+    """Décorateur : durée de chaque appel dans l'histogramme name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_metric(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+def measure_render(generator):
+    """Décorateur des générateurs PDF : durée, octets produits et erreurs"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                pdf_file = func(*args, **kwargs)
+            except Exception:
+                inc_metric("carnet_pdf_render_errors_total", generator=generator)
+                raise
+            finally:
+                observe_metric("carnet_pdf_render_duration_seconds", time.perf_counter() - started, generator=generator)
+            size = pdf_file.seek(0, io.SEEK_END)
+            pdf_file.seek(0)
+            inc_metric("carnet_pdf_render_bytes_total", size, generator=generator)
+            return pdf_file
+        return wrapper
+    return decorator
+
+def flush_metrics():
+    """Écrit les mesures du processus courant dans METRICS_FOLDER/<pid>.json"""
+    with _metrics_lock:
+        if _metrics["pid"] != os.getpid() or not _metrics["dirty"]:
+            return
+        snapshot = json.dumps(_metrics["values"])
+        _metrics["dirty"] = False
+    os.makedirs(app.config["METRICS_FOLDER"], exist_ok=True)
+    with atomic_write(os.path.join(app.config["METRICS_FOLDER"], f"{os.getpid()}.json"), "w") as f:
+        f.write(snapshot)
+
+def _metrics_flush_loop():
+    while True:
+        time.sleep(app.config["METRICS_FLUSH_SECONDS"])
+        try:
+            flush_metrics()
+        except Exception as e:
+            print(f"❌ Erreur écriture des métriques: {e}")
+
+def _merge_metrics(total, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            current = total.setdefault(key, [0] * len(value))
+            for i, item in enumerate(value):
+                current[i] += item
+        else:
+            total[key] = total.get(key, 0) + value
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect_metrics():
+    """Somme des mesures de tous les processus ; les fichiers des processus terminés sont archivés"""
+    flush_metrics()
+    folder = app.config["METRICS_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    archive_path = os.path.join(folder, "archive.json")
+    total = {}
+    with open(os.path.join(folder, "archive.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(archive_path) as f:
+                archive = json.load(f)
+        except (OSError, ValueError):
+            archive = {}
+        archived = []
+        for entry in os.scandir(folder):
+            pid = entry.name[:-len(".json")]
+            if not (entry.name.endswith(".json") and pid.isdigit()):
+                continue
+            try:
+                with open(entry.path) as f:
+                    values = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _process_alive(int(pid)):
+                _merge_metrics(total, values)
+            else:
+                _merge_metrics(archive, values)
+                archived.append(entry.path)
+        if archived:
+            with atomic_write(archive_path, "w") as f:
+                json.dump(archive, f)
+            for path in archived:
+                os.remove(path)
+    _merge_metrics(total, archive)
+    return total
+
+def render_metrics(values):
+    """Texte au format d'exposition Prometheus"""
+    series = {}
+    for key, value in values.items():
+        name, _, labels = key.partition("|")
+        if name in METRICS:
+            series.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.get(name, [])):
+            pairs = [pair.split("=", 1) for pair in labels.split(",")] if labels else []
+            label_text = ",".join(f'{key}="{val}"' for key, val in pairs)
+            braces = f"{{{label_text}}}" if label_text else ""
+            if kind == "histogram":
+                for bound, count in zip(buckets + ("+Inf",), value[:len(buckets)] + [value[-1]]):
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{{{label_text + ',' if label_text else ''}{le}}} {count}")
+                lines.append(f"{name}_sum{braces} {value[-2]}")
+                lines.append(f"{name}_count{braces} {value[-1]}")
+            else:
+                lines.append(f"{name}{braces} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MongoCommandMetrics(monitoring.CommandListener):
+    """Durée et erreurs des commandes MongoDB (find, insert, update...)"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe_metric("carnet_mongo_command_duration_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        observe_metric("carnet_mongo_command_duration_seconds", event.duration_micros / 1e6, command=event.command_name)
+        inc_metric("carnet_mongo_command_errors_total", command=event.command_name)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("metrics_started")
+    if started is not None and request.url_rule is not None:
+        route = request.url_rule.rule
+        inc_metric("carnet_http_requests_total", route=route, method=request.method, status=response.status_code)
+        observe_metric("carnet_http_request_duration_seconds", time.perf_counter() - started, route=route)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Métriques agrégées de tous les workers, au format Prometheus"""
+    if not app.config["METRICS_ENABLED"]:
+        return "Métriques désactivées", 404
+    return Response(render_metrics(collect_metrics()), mimetype="text/plain; version=0.0.4")
+
+# Créer le dossier uploads
+os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+
+# Fonction utilitaire pour formater les dates
+def format_date(date_str):
+    """Formate une date de YYYY-MM-DD à DD/MM/YYYY"""
+    if not date_str:
+        return ""
+    try:
+        if "-" in date_str:
+            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
+            return date_obj.strftime("%d/%m/%Y")
+        return date_str
+    except:
+        return date_str
+
+# ==================== FICHIERS TÉLÉVERSÉS ====================
+
+# Champs des documents qui référencent un fichier du dossier des uploads
+UPLOAD_FIELDS = {
+    "carnets": ("photo", "cachet", "signature"),
+    "attestations": ("stamp_image", "signature_path"),
+}
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """Ouvre un fichier temporaire propre à l'appelant, renommé en path à la fermeture.
+
+    Le nom temporaire est unique (uuid) : deux threads ou workers qui écrivent
+    le même fichier ne partagent jamais leur fichier temporaire, et un lecteur
+    voit l'ancien contenu complet ou le nouveau, jamais un fichier partiel.
+    En cas d'erreur le fichier temporaire est supprimé et path reste intact.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def store_upload(content, kind, extension, folder=None):
+    """Enregistre un contenu sous son empreinte SHA-256 et retourne son chemin.
+
+    Le nom dépend uniquement du contenu : deux requêtes simultanées ne peuvent
+    obtenir le même nom que pour des octets identiques, et un contenu déjà
+    présent (le même cachet envoyé pour chaque attestation) n'est pas réécrit.
+
+    Tout fichier du dossier des uploads est inscrit dans la collection uploads
+    (compteur à 0 tant qu'aucun document ne le retient) : si le document qui
+    devait le référencer n'est jamais enregistré, le ramasse-miettes le retrouve.
+    """
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    name = f"{kind}_{digest}.{extension}"
+    path = os.path.join(folder or app.config["UPLOAD_FOLDER"], name)
+    if os.path.exists(path):
+        inc_metric("carnet_upload_deduplicated_total", kind=kind)
+    else:
+        with atomic_write(path) as f:
+            f.write(content)
+        inc_metric("carnet_upload_stored_bytes_total", len(content), kind=kind)
+    if folder is None:
+        # date_utilisation repousse le délai de grâce du ramasse-miettes (le fichier
+        # lui-même n'est pas touché : son mtime sert de clé à file_digest)
+        db.uploads.update_one({"_id": name},
+                              {"$set": {"date_utilisation": datetime.now()},
+                               "$setOnInsert": {"refs": 0, "date_creation": datetime.now()}},
+                              upsert=True)
+    return path
+
+def document_uploads(collection, document):
+    """Noms des fichiers d'upload référencés par un document"""
+    return [os.path.basename(document[field]) for field in UPLOAD_FIELDS[collection] if document.get(field)]
+
+def upload_references(name):
+    """Nombre de documents qui référencent le fichier d'upload name (une requête indexée par collection)"""
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    return sum(db[collection].count_documents({"$or": [{field: path} for field in fields]})
+               for collection, fields in UPLOAD_FIELDS.items())
+
+def referenced_uploads():
+    """Nombre de références de chaque fichier d'upload, d'après les carnets et attestations.
+
+    Parcourt les deux collections : réservé à `flask recount-uploads`.
+    """
+    counts = {}
+    for collection, fields in UPLOAD_FIELDS.items():
+        projection = {field: 1 for field in fields}
+        for document in db[collection].find({"$or": [{field: {"$type": "string"}} for field in fields]}, projection):
+            for name in document_uploads(collection, document):
+                counts[name] = counts.get(name, 0) + 1
+    return counts
+
+def retain_uploads(collection, document):
+    """Incrémente le compteur de références (collection uploads) des fichiers du document"""
+    operations = [UpdateOne({"_id": name},
+                            {"$inc": {"refs": 1}, "$setOnInsert": {"date_creation": datetime.now()}},
+                            upsert=True)
+                  for name in document_uploads(collection, document)]
+    if operations:
+        db.uploads.bulk_write(operations, ordered=False)
+
+def release_uploads(collection, document):
+    """Décrémente le compteur de références des fichiers du document.
+
+    Le compteur décide seul de ce que le ramasse-miettes examine : un fichier
+    revenu à 0 reste sur disque jusqu'à son passage, pour ne jamais retirer un
+    fichier qu'une requête concurrente vient de réutiliser.
+    """
+    operations = [UpdateOne({"_id": name}, {"$inc": {"refs": -1}})
+                  for name in document_uploads(collection, document)]
+    if operations:
+        db.uploads.bulk_write(operations, ordered=False)
+
+@app.cli.command("recount-uploads")
+def recount_uploads_command():
+    """Recalcule les compteurs de références des uploads à partir des documents.
+
+    Les fichiers du dossier que rien ne référence sont inscrits avec un compteur
+    à 0, pour que le ramasse-miettes (qui part de la collection uploads) les voie.
+    """
+    counts = referenced_uploads()
+    db.uploads.update_many({"_id": {"$nin": list(counts)}}, {"$set": {"refs": 0}})
+    operations = [UpdateOne({"_id": name}, {"$set": {"refs": refs}, "$setOnInsert": {"date_creation": datetime.now()}},
+                            upsert=True)
+                  for name, refs in counts.items()]
+    operations += [UpdateOne({"_id": entry.name}, {"$setOnInsert": {"refs": 0, "date_creation": datetime.now()}},
+                             upsert=True)
+                   for entry in os.scandir(app.config["UPLOAD_FOLDER"])
+                   if entry.is_file() and entry.name not in counts
+                   and not entry.name.startswith(".") and not entry.name.endswith(".tmp")]
+    if operations:
+        db.uploads.bulk_write(operations, ordered=False)
+    click.echo(f"{len(counts)} fichiers référencés, {sum(counts.values())} références")
+
+def save_signature(signature_data):
+    """Décode une signature data:image/...;base64 et l'enregistre dans le dossier des uploads.
+
+    Retourne le chemin du fichier, ou None si la donnée est absente ou invalide.
+    Seul ce chemin est conservé dans MongoDB, jamais la data URL elle-même.
+    """
+    if not signature_data or not signature_data.startswith('data:image'):
+        return None
+    try:
+        header, encoded = signature_data.split(",", 1)
+        return store_upload(base64.b64decode(encoded), "signature", "png")
+    except Exception as e:
+        print(f"Erreur signature: {e}")
+        return None
+
+# Traitement appliqué à chaque type d'image téléversée : taille maximale en pixels,
+# conservation de la transparence (PNG en palette) et qualité JPEG sinon
+IMAGE_PROFILES = {
+    # Photo de l'animal, imprimée sur 10 x 10 cm
+    "photo": {"max_size": (800, 800), "transparency": False, "quality": 80},
+    # Cachets : imprimés sur 3 x 3 cm, souvent photographiés (JPEG) ou détourés (PNG)
+    "cachet": {"max_size": (600, 600), "transparency": True, "quality": 85},
+}
+
+def _has_transparency(img):
+    if img.mode == "P":
+        return "transparency" in img.info
+    if img.mode in ("RGBA", "LA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return False
+
+@timed("carnet_image_ingest_duration_seconds")
+@needs_pdf_stack
+def ingest_image(stream, kind, folder=None):
+    """Décode une image téléversée en une passe et l'enregistre selon son profil.
+
+    Les JPEG sont décodés directement à l'échelle réduite (mode draft),
+    l'orientation EXIF est appliquée puis l'image est bornée à la taille
+    du profil. Les images réellement transparentes sont encodées en PNG
+    256 couleurs, les autres en JPEG, puis enregistrées sous leur empreinte
+    (store_upload). Retourne le chemin du fichier, ou None si le contenu
+    n'est pas une image lisible.
+    """
+    profile = IMAGE_PROFILES[kind]
+    try:
+        img = PILImage.open(stream)
+        if img.format == "JPEG":
+            img.draft("RGB", profile["max_size"])
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(profile["max_size"])
+
+        if profile["transparency"] and _has_transparency(img):
+            extension = "png"
+            img = img.convert("RGBA").quantize(256, method=PILImage.Quantize.FASTOCTREE)
+            options = {"format": "PNG"}
+        else:
+            extension = "jpg"
+            if img.mode != "RGB":
+                # Fond blanc sous les zones transparentes
+                rgba = img.convert("RGBA")
+                img = PILImage.new("RGB", rgba.size, "white")
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            options = {"format": "JPEG", "quality": profile["quality"], "optimize": True}
+
+        encoded = io.BytesIO()
+        img.save(encoded, **options)
+        inc_metric("carnet_upload_received_bytes_total", stream.seek(0, io.SEEK_END), kind=kind)
+        return store_upload(encoded.getvalue(), kind, extension, folder)
+    except Exception as e:
+        print(f"Erreur image ({kind}): {e}")
+        return None
+
+@app.cli.command("bench-ingest")
+@click.argument("files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--kind", type=click.Choice(sorted(IMAGE_PROFILES)), default="cachet", show_default=True)
+def bench_ingest_command(files, kind):
+    """Compare l'enregistrement brut des uploads et ingest_image() (octets stockés, temps CPU)"""
+    load_pdf_stack()
+    totals = {"brut": [0, 0.0], "ingest": [0, 0.0]}
+    with tempfile.TemporaryDirectory() as folder:
+        for source in files:
+            # Ancien traitement : fichier enregistré tel quel (photo : ré-ouverte puis réduite)
+            start = time.process_time()
+            raw_path = os.path.join(folder, "brut_" + os.path.basename(source))
+            shutil.copyfile(source, raw_path)
+            if kind == "photo":
+                img = PILImage.open(raw_path)
+                img.thumbnail(IMAGE_PROFILES["photo"]["max_size"])
+                img.save(raw_path)
+            raw = (os.path.getsize(raw_path), time.process_time() - start)
+
+            start = time.process_time()
+            with open(source, "rb") as stream:
+                path = ingest_image(stream, kind, folder)
+            new = (os.path.getsize(path) if path else 0, time.process_time() - start)
+            if path:
+                os.remove(path)
+
+            for label, (size, cpu) in (("brut", raw), ("ingest", new)):
+                totals[label][0] += size
+                totals[label][1] += cpu
+            click.echo(f"{os.path.basename(source)}: {raw[0]} -> {new[0]} octets, "
+                       f"{raw[1] * 1000:.1f} -> {new[1] * 1000:.1f} ms CPU")
+    click.echo(f"TOTAL: {totals['brut'][0]} -> {totals['ingest'][0]} octets, "
+               f"{totals['brut'][1] * 1000:.1f} -> {totals['ingest'][1] * 1000:.1f} ms CPU")
+
+@app.cli.command("migrate-signatures")
+@click.option("--batch-size", default=500, show_default=True, help="Carnets mis à jour par lot")
+def migrate_signatures_command(batch_size):
+    """Retire signature_data des carnets existants (la signature reste en fichier)"""
+    migrated = recovered = freed = 0
+    while True:
+        batch = list(db.carnets.find({"signature_data": {"$exists": True}},
+                                     {"signature_data": 1, "signature": 1}).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for carnet in batch:
+            update = {"$unset": {"signature_data": ""}}
+            signature_data = carnet.get("signature_data") or ""
+            # Signature jamais décodée (ou fichier perdu) : on la récupère avant de supprimer la data URL
+            if not (carnet.get("signature") and os.path.exists(carnet["signature"])):
+                signature_path = save_signature(signature_data)
+                if signature_path:
+                    update["$set"] = {"signature": signature_path}
+                    retain_uploads("carnets", {"signature": signature_path})
+                    recovered += 1
+            operations.append(UpdateOne({"_id": carnet["_id"]}, update))
+            freed += len(signature_data)
+        db.carnets.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+        click.echo(f"... {migrated} carnets migrés")
+    click.echo(f"{migrated} carnets migrés, {recovered} signatures récupérées en fichier, "
+               f"{freed} octets de data URL supprimés")
+
+def _multipart(fields, files):
+    """Corps multipart/form-data (fields : {nom: valeur}, files : {nom: (nom de fichier, octets)})"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+@needs_pdf_stack
+def _stress_images(index):
+    """Cachet et signature propres à une requête du test de charge (contenus tous différents)"""
+    stamp = PILImage.new("RGB", (400, 400), "white")
+    signature = PILImage.new("RGBA", (300, 120), (0, 0, 0, 0))
+    # Le numéro de la requête est dessiné en binaire (un carré par bit) dans les deux images
+    for img, color in ((stamp, (0, 0, 160)), (signature, (0, 0, 0, 255))):
+        draw = ImageDraw.Draw(img)
+        for bit in range(max(index.bit_length(), 1)):
+            if (index >> bit) & 1:
+                draw.rectangle((10 + bit * 12, 10, 18 + bit * 12, 18), fill=color)
+    stamp_bytes, signature_bytes = io.BytesIO(), io.BytesIO()
+    stamp.save(stamp_bytes, format="PNG")
+    signature.save(signature_bytes, format="PNG")
+    return stamp_bytes.getvalue(), signature_bytes.getvalue()
+
+@app.cli.command("stress-uploads")
+@click.option("--url", default="http://127.0.0.1:5000", show_default=True, help="Instance à solliciter (gunicorn multi-workers)")
+@click.option("--requests", "count", default=200, show_default=True, help="Nombre de formulaires envoyés")
+@click.option("--concurrency", default=32, show_default=True, help="Requêtes simultanées")
+@click.option("--keep", is_flag=True, help="Conserver les carnets et attestations créés")
+def stress_uploads_command(url, count, concurrency, keep):
+    """Envoie des /save et /attestation/generer en parallèle et vérifie qu'aucun fichier n'est partagé.
+
+    Chaque requête porte un cachet et une signature uniques. On vérifie ensuite
+    que chaque document créé référence des fichiers distincts de ceux des autres
+    documents, que chaque fichier correspond à son empreinte, et que la
+    signature enregistrée est bien celle envoyée par la requête.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.request import Request, urlopen
+
+    run = uuid.uuid4().hex[:8]
+
+    def send(index):
+        stamp, signature = _stress_images(index)
+        signature_url = "data:image/png;base64," + base64.b64encode(signature).decode()
+        marker = f"stress-{run}-{index}"
+        if index % 2:
+            route, collection, marker_field = "/attestation/generer", "attestations", "animal_name"
+            body, content_type = _multipart({"vet-fullname": "Test de charge", "animal-name": marker,
+                                             "attestation-health": "on", "signature-data": signature_url},
+                                            {"stamp-file": ("cachet.png", stamp)})
+        else:
+            route, collection, marker_field = "/save", "carnets", "name"
+            body, content_type = _multipart({"name": marker, "species": "Chien", "signature_data": signature_url},
+                                            {"cachet": ("cachet.png", stamp)})
+        request_ = Request(url.rstrip("/") + route, data=body, headers={"Content-Type": content_type})
+        with urlopen(request_, timeout=120) as response:
+            response.read()
+        return collection, marker_field, marker, hashlib.sha256(signature).hexdigest()[:32]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sent = list(pool.map(send, range(count)))
+    click.echo(f"{count} requêtes en {time.perf_counter() - started:.1f} s")
+
+    owners, errors, documents = {}, [], []
+    for collection, marker_field, marker, signature_digest in sent:
+        document = db[collection].find_one({marker_field: marker})
+        if document is None:
+            errors.append(f"{marker}: document introuvable")
+            continue
+        documents.append((collection, document))
+        names = document_uploads(collection, document)
+        if f"signature_{signature_digest}.png" not in names:
+            errors.append(f"{marker}: signature enregistrée différente de celle envoyée")
+        for name in names:
+            if name in owners:
+                errors.append(f"{marker}: {name} déjà utilisé par {owners[name]}")
+            owners[name] = marker
+            path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+            digest = name.rsplit("_", 1)[-1].split(".")[0]
+            if not os.path.exists(path) or file_digest(path)[:32] != digest:
+                errors.append(f"{marker}: {name} absent ou contenu différent de son empreinte")
+
+    if not keep:
+        for collection, document in documents:
+            db[collection].delete_one({"_id": document["_id"]})
+            release_uploads(collection, document)
+    for error in errors[:20]:
+        click.echo(f"❌ {error}")
+    click.echo(f"{len(documents)} documents, {len(owners)} fichiers, {len(errors)} collisions ou erreurs")
+    if errors:
+        raise SystemExit(1)
+
+# ==================== REGISTRE DES STYLES PDF ====================
+
+# Thèmes construits une seule fois par worker (clé = type de document)
+_THEMES = {}
+
+def get_theme(name):
+    """Retourne le thème (couleurs, styles de paragraphe, styles de tableau) d'un type de document"""
+    theme = _THEMES.get(name)
+    if theme is None:
+        theme = _THEMES[name] = _THEME_BUILDERS[name]()
+    return theme
+
+def _build_carnet_theme():
+    """Palette bleue du carnet de santé"""
+    styles = getSampleStyleSheet()
+
+    COLOR_PRIMARY = colors.HexColor('#2C3E50')      # Bleu foncé
+    COLOR_SECONDARY = colors.HexColor('#3498DB')    # Bleu
+    COLOR_ACCENT = colors.HexColor('#E74C3C')       # Rouge
+    COLOR_SUCCESS = colors.HexColor('#27AE60')      # Vert
+    COLOR_WARNING = colors.HexColor('#F39C12')      # Orange
+    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
+
+    paragraph_styles = {
+        'MainTitle': ParagraphStyle(
+            name='MainTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=COLOR_PRIMARY,
+            alignment=1,
+            spaceAfter=20,
+            spaceBefore=0,
+            fontName='Helvetica-Bold',
+            underlineWidth=1,
+            underlineColor=COLOR_SECONDARY
+        ),
+        'SectionTitle': ParagraphStyle(
+            name='SectionTitle',
+            parent=styles['Heading2'],
+            fontSize=18,
+            textColor=COLOR_PRIMARY,
+            alignment=0,
+            spaceAfter=15,
+            spaceBefore=25,
+            fontName='Helvetica-Bold',
+            borderPadding=8,
+            borderColor=COLOR_SECONDARY,
+            borderWidth=1,
+            borderRadius=5,
+            backColor=colors.HexColor('#E8F4F8')
+        ),
+        'Subsection': ParagraphStyle(
+            name='Subsection',
+            parent=styles['Heading3'],
+            fontSize=14,
+            textColor=COLOR_SECONDARY,
+            alignment=0,
+            spaceAfter=10,
+            spaceBefore=20,
+            fontName='Helvetica-Bold'
+        ),
+        'Normal': ParagraphStyle(
+            name='Normal',
+            parent=styles['Normal'],
+            fontSize=11,
+            leading=14,
+            textColor=colors.black,
+            alignment=0
+        ),
+        'Label': ParagraphStyle(
+            name='Label',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=COLOR_PRIMARY,
+            fontName='Helvetica-Bold',
+            spaceAfter=3
+        ),
+        'Value': ParagraphStyle(
+            name='Value',
+            parent=styles['Normal'],
+            fontSize=11,
+            textColor=colors.black,
+            backColor=COLOR_LIGHT,
+            borderPadding=8,
+            borderColor=colors.HexColor('#EEEEEE'),
+            borderWidth=1,
+            borderRadius=3
+        ),
+        'TableHeader': ParagraphStyle(
+            name='TableHeader',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.white,
+            alignment=1,
+            fontName='Helvetica-Bold'
+        ),
+        'HeaderLeft': ParagraphStyle(name='HeaderLeft', fontSize=12, textColor=COLOR_PRIMARY, alignment=0),
+        'HeaderRight': ParagraphStyle(name='HeaderRight', fontSize=12, textColor=COLOR_PRIMARY, alignment=2),
+        'AnimalName': ParagraphStyle(
+            name='AnimalName',
+            parent=styles['Heading1'],
+            fontSize=28,
+            textColor=COLOR_ACCENT,
+            alignment=1,
+            spaceAfter=2*cm,
+            fontName='Helvetica-Bold'
+        ),
+        'InfoLabel': ParagraphStyle(name='InfoLabel', fontSize=12, textColor=colors.white,
+                                    fontName='Helvetica-Bold', alignment=1),
+        'InfoValue': ParagraphStyle(name='InfoValue', fontSize=12, textColor=colors.black, alignment=1),
+        'Proprio': ParagraphStyle(name='Proprio', fontSize=12, textColor=COLOR_PRIMARY, alignment=1),
+        'FooterInfo': ParagraphStyle(name='FooterInfo', fontSize=10, textColor=colors.grey, alignment=1),
+        'ContactInfo': ParagraphStyle(
+            name='ContactInfo',
+            fontSize=11,
+            borderWidth=1,
+            borderColor=COLOR_SECONDARY,
+            borderPadding=15,
+            backColor=colors.HexColor('#F8F9FA')
+        ),
+        'ConsultHeader': ParagraphStyle(name='ConsultHeader', fontSize=9, alignment=1,
+                                        fontName='Helvetica-Bold', textColor=colors.white),
+        'ConsultCell': ParagraphStyle(name='ConsultCell', fontSize=9),
+        'Instruction': ParagraphStyle(
+            name='Instruction',
+            fontSize=9,
+            textColor=colors.grey,
+            alignment=2
+        ),
+    }
+
+    table_styles = {
+        'InfoRow': TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('LEFTPADDING', (0,0), (0,-1), 5),
+            ('RIGHTPADDING', (1,0), (1,-1), 5),
+            ('TOPPADDING', (0,0), (-1,-1), 6),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+        ]),
+        'Consult': TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), COLOR_PRIMARY),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#EEEEEE')),
+            ('PADDING', (0,0), (-1,-1), 6),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('MINIMUMHEIGHT', (0,1), (-1,-1), 0.8*cm),
+        ]),
+    }
+
+    return {
+        "colors": {
+            "primary": COLOR_PRIMARY,
+            "secondary": COLOR_SECONDARY,
+            "accent": COLOR_ACCENT,
+            "success": COLOR_SUCCESS,
+            "warning": COLOR_WARNING,
+            "light": COLOR_LIGHT,
+        },
+        "styles": paragraph_styles,
+        "tables": table_styles,
+    }
+
+def _build_facture_theme():
+    """Palette verte de la facture"""
+    styles = getSampleStyleSheet()
+
+    COLOR_PRIMARY = colors.HexColor('#198754')      # Vert
+    COLOR_SECONDARY = colors.HexColor('#2C3E50')    # Bleu foncé
+    COLOR_ACCENT = colors.HexColor('#FF6B6B')       # Rouge clair
+    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
+
+    paragraph_styles = {
+        'TitrePrincipal': ParagraphStyle(
+            name='TitrePrincipal',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=COLOR_PRIMARY,
+            alignment=1,
+            spaceAfter=5,
+            fontName='Helvetica-Bold'
+        ),
+        'SousTitre': ParagraphStyle(
+            name='SousTitre',
+            parent=styles['Heading2'],
+            fontSize=16,
+            textColor=COLOR_SECONDARY,
+            alignment=1,
+            spaceAfter=20,
+            fontName='Helvetica-Bold'
+        ),
+        'Info': ParagraphStyle(
+            name='Info',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.grey,
+            alignment=0
+        ),
+        'Label': ParagraphStyle(
+            name='Label',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=COLOR_SECONDARY,
+            fontName='Helvetica-Bold',
+            spaceAfter=2
+        ),
+        'Value': ParagraphStyle(
+            name='Value',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.black
+        ),
+        'Entreprise': ParagraphStyle(name='Entreprise', fontSize=10),
+        'FactureInfo': ParagraphStyle(name='FactureInfo', fontSize=12, alignment=2),
+        'Notes': ParagraphStyle(name='Notes', fontSize=9, fontStyle='italic'),
+        'SectionHeader': ParagraphStyle(name='SectionHeader', fontSize=11,
+                                        fontName='Helvetica-Bold', alignment=0),
+        'SectionTitre': ParagraphStyle(name='SectionTitre', fontSize=11,
+                                       fontName='Helvetica-Bold', spaceAfter=10),
+        'Center': ParagraphStyle(name='Center', fontSize=10, alignment=1),
+        'Right': ParagraphStyle(name='Right', fontSize=10, alignment=2),
+        'Conditions': ParagraphStyle(name='Conditions', fontSize=9),
+        'Footer': ParagraphStyle(name='Footer', fontSize=8, textColor=colors.grey, alignment=1),
+        'Error': ParagraphStyle(name='Error', fontSize=10),
+    }
+
+    return {
+        "colors": {
+            "primary": COLOR_PRIMARY,
+            "secondary": COLOR_SECONDARY,
+            "accent": COLOR_ACCENT,
+            "light": COLOR_LIGHT,
+        },
+        "styles": paragraph_styles,
+        "tables": {},
+    }
+
+def _build_attestation_theme():
+    """Palette de l'attestation vétérinaire"""
+    styles = getSampleStyleSheet()
+
+    COLOR_PRIMARY = colors.HexColor('#2C3E50')      # Bleu foncé
+    COLOR_SECONDARY = colors.HexColor('#3498DB')    # Bleu
+    COLOR_ACCENT = colors.HexColor('#E74C3C')       # Rouge
+    COLOR_SUCCESS = colors.HexColor('#27AE60')      # Vert
+    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
+
+    style_normal = ParagraphStyle(
+        name='Normal',
+        parent=styles['Normal'],
+        fontSize=10,
+        leading=15,
+        textColor=colors.black,
+        alignment=4,
+    )
+
+    paragraph_styles = {
+        'MainTitle': ParagraphStyle(
+            name='MainTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            textColor=COLOR_PRIMARY,
+            alignment=1,
+            spaceAfter=18,
+            spaceBefore=0,
+            fontName='Helvetica-Bold',
+            underlineWidth=1,
+            underlineColor=COLOR_SECONDARY
+        ),
+        'Header': ParagraphStyle(
+            name='Header',
+            parent=styles['Heading2'],
+            fontSize=14,
+            textColor=COLOR_PRIMARY,
+            alignment=1,
+            spaceAfter=10,
+            spaceBefore=15,
+            fontName='Helvetica-Bold',
+            borderPadding=5,
+            borderColor=COLOR_PRIMARY,
+            borderWidth=0,
+            leftIndent=0
+        ),
+        'Normal': style_normal,
+        'Label': ParagraphStyle(
+            name='Label',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=COLOR_PRIMARY,
+            fontName='Helvetica-Bold',
+            spaceAfter=3
+        ),
+        'Value': ParagraphStyle(
+            name='Value',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.black,
+            backColor=COLOR_LIGHT,
+            borderPadding=8,
+            borderColor=colors.HexColor('#EEEEEE'),
+            borderWidth=1,
+            borderRadius=3
+        ),
+        'CabinetInfo': ParagraphStyle(name='CabinetInfo', fontSize=10, alignment=1, textColor=COLOR_PRIMARY),
+        'ExamTitle': ParagraphStyle(name='ExamTitle', parent=styles['Heading3'],
+                                    fontSize=13, textColor=COLOR_PRIMARY),
+        'Checked': ParagraphStyle(name='Checked', parent=style_normal, textColor=COLOR_SUCCESS),
+        'Unchecked': ParagraphStyle(name='Unchecked', parent=style_normal, textColor=colors.grey),
+        'FinalText': ParagraphStyle(name='FinalText', fontSize=10, alignment=1, fontStyle='italic'),
+        'DateCol': ParagraphStyle(name='DateCol', fontSize=10, alignment=0),
+        'SignatureLabel': ParagraphStyle(name='SignatureLabel', fontSize=10, alignment=2),
+        'Footer': ParagraphStyle(name='Footer', fontSize=6, textColor=colors.grey, alignment=1),
+    }
+
+    return {
+        "colors": {
+            "primary": COLOR_PRIMARY,
+            "secondary": COLOR_SECONDARY,
+            "accent": COLOR_ACCENT,
+            "success": COLOR_SUCCESS,
+            "light": COLOR_LIGHT,
+        },
+        "styles": paragraph_styles,
+        "tables": {},
+    }
+
+def _build_carte_theme():
+    """Palette noire de la carte d'identification (variantes complète, haute et basse)"""
+    styles = getSampleStyleSheet()
+
+    # Couleurs officielles
+    COLOR_PRIMARY = colors.black
+    COLOR_SECONDARY = colors.HexColor('#666666')
+
+    # Couleurs I-CAD (partie haute)
+    BLUE_DARK = colors.HexColor("#2F4858")
+    BLUE_LIGHT = colors.HexColor("#F4F8FB")
+    BLUE_BORDER = colors.HexColor("#4A90E2")
+
+    paragraph_styles = {
+        # ----- Carte complète -----
+        'Entreprise': ParagraphStyle(
+            name='Entreprise',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=COLOR_PRIMARY,
+            alignment=1,
+            fontName='Helvetica-Bold'
+        ),
+        'Normal': ParagraphStyle(
+            name='Normal',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=COLOR_PRIMARY,
+            alignment=0,
+            leading=10
+        ),
+        'Label': ParagraphStyle(
+            name='Label',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=COLOR_PRIMARY,
+            fontName='Helvetica-Bold',
+            spaceAfter=1
+        ),
+        'Value': ParagraphStyle(
+            name='Value',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=COLOR_PRIMARY
+        ),
+        'Login': ParagraphStyle(
+            name='Login',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=COLOR_PRIMARY,
+            fontName='Helvetica-Bold',
+            alignment=1,
+            backColor=colors.HexColor('#F0F0F0'),
+            borderPadding=6
+        ),
+        'Section': ParagraphStyle(
+            name='Section',
+            parent=styles['Heading2'],
+            fontSize=10,
+            textColor=COLOR_PRIMARY,
+            fontName='Helvetica-Bold',
+            spaceAfter=5,
+            spaceBefore=10
+        ),
+        'Date': ParagraphStyle(name='Date', fontSize=8, alignment=0),
+        'PartieBasse': ParagraphStyle(name='PartieBasse', fontSize=8, alignment=1,
+                                      fontName='Helvetica-Bold'),
+        'NumReduit': ParagraphStyle(name='NumReduit', fontSize=14,
+                                    fontName='Helvetica-Bold', alignment=1),
+        'InfoBasse': ParagraphStyle(name='InfoBasse', fontSize=8),
+
+        # ----- Partie haute -----
+        'HeaderText': ParagraphStyle(
+            name="HeaderText",
+            alignment=1,
+            fontSize=9,
+            leading=12
+        ),
+        'Intro': ParagraphStyle(
+            name="Intro",
+            fontSize=8.5,
+            leading=12
+        ),
+        'HauteLogin': ParagraphStyle(
+            name="Login",
+            fontSize=9,
+            leading=14
+        ),
+        'SectionTitle': ParagraphStyle(name="SectionTitle", fontSize=9),
+        'Lbl': ParagraphStyle(name="Lbl", fontSize=8),
+        'Val': ParagraphStyle(name="Val", fontSize=8),
+        'HauteFooter': ParagraphStyle(
+            name="Footer",
+            fontSize=7,
+            alignment=1,
+            textColor=colors.grey
+        ),
+
+        # ----- Partie basse -----
+        'Titre': ParagraphStyle(
+            name="Titre",
+            fontName="Helvetica-Bold",
+            fontSize=12,
+            alignment=1,
+            textColor=colors.HexColor("#1F3A5F"),
+            leading=16,
+            spaceAfter=10
+        ),
+        'SousTitre': ParagraphStyle(
+            name="SousTitre",
+            fontSize=9,
+            alignment=1,
+            textColor=colors.grey,
+            italic=True,
+            spaceAfter=16
+        ),
+        'Num': ParagraphStyle(
+            name="Num",
+            fontName="Helvetica-Bold",
+            fontSize=20,
+            alignment=1,
+            textColor=colors.HexColor("#2E86DE")
+        ),
+        'Infos': ParagraphStyle(
+            name="Infos",
+            fontSize=9.5,
+            leading=15,
+            textColor=colors.HexColor("#263238"),
+            alignment=2
+        ),
+        'BasseFooter': ParagraphStyle(
+            name="Footer",
+            fontSize=8,
+            alignment=1,
+            textColor=colors.grey
+        ),
+    }
+
+    grid = TableStyle([
+        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+        ('PADDING', (0,0), (-1,-1), 3),
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ])
+
+    table_styles = {
+        'Grid': grid,
+        'HauteSection': TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.whitesmoke),
+            ('BACKGROUND', (0,1), (-1,-1), BLUE_LIGHT),
+            ('LINEBEFORE', (0,0), (0,-1), 4, BLUE_BORDER),
+            ('GRID', (0,0), (-1,-1), 0.3, colors.lightgrey),
+            ('PADDING', (0,0), (-1,-1), 6),
+        ]),
+        # Partie basse : bloc du numéro réduit et cadre de la carte
+        'BasseNum': TableStyle([
+            ('BACKGROUND', (0,0), (-1,-1), colors.HexColor("#EEF6FD")),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('BOX', (0,0), (-1,-1), 2, colors.white),
+            ('ROUNDEDCORNERS', [8, 8, 8, 8]),
+        ]),
+        'BasseCarte': TableStyle([
+            ('BOX', (0,0), (-1,-1), 1.2, colors.HexColor("#B0BEC5")),
+            ('BACKGROUND', (0,0), (-1,-1), colors.white),
+            ('LEFTPADDING', (0,0), (-1,-1), 16),
+            ('RIGHTPADDING', (0,0), (-1,-1), 16),
+            ('TOPPADDING', (0,0), (-4,-4), 18),
+            ('BOTTOMPADDING', (0,0), (-4,-4), 18),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('ROUNDEDCORNERS', [6, 6, 6, 6]),
+        ]),
+    }
+
+    return {
+        "colors": {
+            "primary": COLOR_PRIMARY,
+            "secondary": COLOR_SECONDARY,
+            "blue_dark": BLUE_DARK,
+            "blue_light": BLUE_LIGHT,
+            "blue_border": BLUE_BORDER,
+        },
+        "styles": paragraph_styles,
+        "tables": table_styles,
+    }
+
+_THEME_BUILDERS = {
+    "carnet": _build_carnet_theme,
+    "facture": _build_facture_theme,
+    "attestation": _build_attestation_theme,
+    "carte": _build_carte_theme,
+}
+
+# ==================== RENDU PDF EN MÉMOIRE ====================
+
+def new_pdf_buffer():
+    """Crée le tampon de rendu d'un PDF.
+
+    Le PDF reste en mémoire et n'est déversé dans un fichier temporaire
+    (supprimé à la fermeture) qu'au-delà de PDF_SPOOL_MAX_SIZE octets.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=app.config["PDF_SPOOL_MAX_SIZE"], mode="w+b")
+
+def send_pdf(pdf_file, download_name, mimetype="application/pdf"):
+    """Envoie un tampon de rendu au client ; Flask le ferme une fois la réponse terminée"""
+    size = pdf_file.seek(0, os.SEEK_END)
+    pdf_file.seek(0)
+    # Tant que le tampon est en mémoire, on envoie son BytesIO : gunicorn teste
+    # fileno() pour utiliser sendfile, ce qui déverserait le tampon sur disque
+    if isinstance(pdf_file, tempfile.SpooledTemporaryFile) and not pdf_file._rolled:
+        data = pdf_file._file.getvalue()
+        pdf_file.close()
+        pdf_file = io.BytesIO(data)
+    response = send_file(pdf_file, mimetype=mimetype, as_attachment=True,
+                         download_name=download_name)
+    response.content_length = size
+    return response
+
+# ==================== CACHE DES PDF RENDUS ====================
+
+# Cache LRU par worker : empreinte du document -> octets du PDF
+_pdf_cache = OrderedDict()
+_pdf_cache_size = 0
+_pdf_cache_lock = threading.Lock()
+
+# Empreintes des fichiers images (LRU), mémorisées par (chemin, inode, taille, mtime)
+_file_digests = OrderedDict()
+_file_digests_lock = threading.Lock()
+
+def file_digest(path):
+    """Empreinte SHA-256 du contenu d'un fichier"""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        digest = _file_digests.get(memo_key)
+        if digest is not None:
+            _file_digests.move_to_end(memo_key)
+            return digest
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _file_digests_lock:
+        _file_digests[memo_key] = digest
+        while len(_file_digests) > app.config["FILE_DIGEST_CACHE_ENTRIES"]:
+            _file_digests.popitem(last=False)
+    return digest
+
+def carnet_cache_key(carnet, image_fields=UPLOAD_FIELDS["carnets"]):
+    """Clé de cache d'un carnet : champs du document + contenu des images référencées"""
+    h = hashlib.sha256()
+    h.update(json.dumps(carnet, sort_keys=True, default=str).encode())
+    for field in image_fields:
+        path = carnet.get(field)
+        if path and os.path.exists(path):
+            h.update(f"{field}:{file_digest(path)}".encode())
+    return h.hexdigest()
+
+def pdf_cache_get(key):
+    """Retourne le PDF en cache (ou None) et le marque comme récemment utilisé"""
+    with _pdf_cache_lock:
+        pdf_bytes = _pdf_cache.get(key)
+        if pdf_bytes is not None:
+            _pdf_cache.move_to_end(key)
+        return pdf_bytes
+
+def pdf_cache_put(key, pdf_bytes):
+    """Ajoute un PDF au cache en évinçant les moins récemment utilisés"""
+    global _pdf_cache_size
+    max_bytes = app.config["PDF_CACHE_MAX_BYTES"]
+    if len(pdf_bytes) > max_bytes:
+        return
+    with _pdf_cache_lock:
+        previous = _pdf_cache.pop(key, None)
+        if previous is not None:
+            _pdf_cache_size -= len(previous)
+        _pdf_cache[key] = pdf_bytes
+        _pdf_cache_size += len(pdf_bytes)
+        while _pdf_cache_size > max_bytes:
+            _, evicted = _pdf_cache.popitem(last=False)
+            _pdf_cache_size -= len(evicted)
+
+# ==================== VARIANTES D'IMAGES POUR LE PDF ====================
+
+# (empreinte source, largeur px, hauteur px) -> chemin de la variante
+_variants = {}
+
+@needs_pdf_stack
+def print_variant(path, width, height):
+    """Chemin d'une version de l'image dimensionnée pour sa zone d'impression.
+
+    width et height sont les dimensions de la zone dans le PDF (points).
+    L'image est réduite à PDF_IMAGE_DPI pour cette zone et enregistrée
+    dans PDF_VARIANT_FOLDER sous une clé (empreinte source, taille cible),
+    de sorte que les rendus suivants intègrent directement la petite image.
+    Une source déjà assez petite est utilisée telle quelle.
+    """
+    dpi = app.config["PDF_IMAGE_DPI"]
+    target = (max(1, round(width / 72 * dpi)), max(1, round(height / 72 * dpi)))
+    try:
+        memo_key = (file_digest(path), target)
+        variant = _variants.get(memo_key)
+        if variant and os.path.exists(variant):
+            return variant
+
+        base = os.path.join(app.config["PDF_VARIANT_FOLDER"], f"{memo_key[0][:32]}_{target[0]}x{target[1]}")
+        variant = next((base + ext for ext in (".jpg", ".png") if os.path.exists(base + ext)), None)
+        if variant is None:
+            img = PILImage.open(path)
+            size = (min(img.width, target[0]), min(img.height, target[1]))
+            # Réduction négligeable : la ré-encoder coûterait plus qu'elle ne rapporte
+            if size[0] * size[1] * 1.5 >= img.width * img.height:
+                variant = path
+            else:
+                if img.format == "JPEG":
+                    img.draft("RGB", size)
+                img = img.resize(size, PILImage.LANCZOS)
+                # JPEG : ReportLab l'intègre sans le décoder ; PNG pour garder la transparence
+                if img.mode in ("RGBA", "LA", "P"):
+                    variant, options = base + ".png", {"format": "PNG"}
+                else:
+                    variant, options = base + ".jpg", {"format": "JPEG", "quality": 85}
+                    img = img.convert("RGB")
+                os.makedirs(app.config["PDF_VARIANT_FOLDER"], exist_ok=True)
+                with atomic_write(variant) as f:
+                    img.save(f, **options)
+        _variants[memo_key] = variant
+        return variant
+    except Exception as e:
+        print(f"Erreur variante image {path}: {e}")
+        return path
+
+# ==================== OBJETS IMAGES PDF PRÉPARÉS ====================
+
+# Cache LRU par worker : empreinte du fichier -> (objet image PDF, coût CPU de sa préparation)
+_pdf_images = OrderedDict()
+_pdf_images_size = 0
+_pdf_images_lock = threading.Lock()
+# Compteurs cumulés du worker (le temps évité est le coût CPU des préparations réutilisées)
+_pdf_image_stats = {"hits": 0, "misses": 0, "cpu_seconds_saved": 0.0}
+
+def _define_prepared_image():
+    """Classe PreparedImage, définie au chargement de ReportLab (voir load_pdf_stack)"""
+
+    class PreparedImage(Flowable):
+        """Image dont l'objet PDF (pixels décodés et compressés) est partagé entre les rendus.
+
+        ReportLab recrée l'objet image de chaque document à partir du fichier :
+        pour un PNG, cela signifie décoder puis recompresser les pixels à
+        chaque attestation. Ici l'objet est préparé une fois par worker et
+        seule une copie légère est enregistrée dans chaque document.
+        """
+
+        def __init__(self, xobject, width, height, cache_hit=False, cpu_seconds=0.0):
+            Flowable.__init__(self)
+            self.xobject = xobject
+            self.drawWidth, self.drawHeight = width, height
+            self.cache_hit = cache_hit
+            self.cpu_seconds = cpu_seconds
+
+        def wrap(self, availWidth, availHeight):
+            return self.drawWidth, self.drawHeight
+
+        def draw(self):
+            # Même enregistrement que Canvas.drawImage, sans reconstruire l'objet image
+            canv = self.canv
+            reg_name = canv._doc.getXObjectName(self.xobject.name)
+            if reg_name not in canv._doc.idToObject:
+                xobject = copy.copy(self.xobject)
+                canv._setXObjects(xobject)
+                canv._doc.Reference(xobject, reg_name)
+                canv._doc.addForm(xobject.name, xobject)
+                smask = getattr(xobject, "_smask", None)
+                if smask is not None:
+                    mask_name = canv._doc.getXObjectName(smask.name)
+                    if mask_name not in canv._doc.idToObject:
+                        smask = copy.copy(smask)
+                        canv._setXObjects(smask)
+                        xobject.smask = canv._doc.Reference(smask, mask_name)
+                    else:
+                        xobject.smask = pdfdoc.PDFObjectReference(mask_name)
+                    del xobject._smask
+            canv._currentPageHasImages = 1
+            canv.saveState()
+            canv.scale(self.drawWidth, self.drawHeight)
+            canv._code.append(f"/{reg_name} Do")
+            canv.restoreState()
+            canv._formsinuse.append(self.xobject.name)
+
+    return PreparedImage
+
+@needs_pdf_stack
+def pdf_image(path, width, height):
+    """Flowable d'une image dimensionnée pour sa zone, à partir du cache des objets préparés"""
+    global _pdf_images_size
+    path = print_variant(path, width, height)
+    digest = file_digest(path)
+    with _pdf_images_lock:
+        cached = _pdf_images.get(digest)
+        if cached is not None:
+            _pdf_images.move_to_end(digest)
+            _pdf_image_stats["hits"] += 1
+            _pdf_image_stats["cpu_seconds_saved"] += cached[1]
+            return PreparedImage(cached[0], width, height, True, cached[1])
+
+    started = time.process_time()
+    xobject = pdfdoc.PDFImageXObject(f"img_{digest[:32]}", path, mask="auto")
+    cpu_seconds = time.process_time() - started
+    size = len(xobject.streamContent) + len(getattr(getattr(xobject, "_smask", None), "streamContent", b""))
+    with _pdf_images_lock:
+        _pdf_image_stats["misses"] += 1
+        if size <= app.config["PDF_IMAGE_CACHE_MAX_BYTES"] and digest not in _pdf_images:
+            _pdf_images[digest] = (xobject, cpu_seconds)
+            _pdf_images_size += size
+            while _pdf_images_size > app.config["PDF_IMAGE_CACHE_MAX_BYTES"]:
+                _, (evicted, _) = _pdf_images.popitem(last=False)
+                _pdf_images_size -= len(evicted.streamContent) + len(getattr(getattr(evicted, "_smask", None), "streamContent", b""))
+    return PreparedImage(xobject, width, height, False, cpu_seconds)
+
+def image_cache_note(images):
+    """Résumé pour les logs : images réutilisées dans un document et CPU évité"""
+    hits = [img for img in images if img.cache_hit]
+    return (f"images {len(hits)}/{len(images)} en cache, "
+            f"{sum(img.cpu_seconds for img in hits) * 1000:.1f} ms CPU évités")
+
+# ==================== BLOCS ET PAGES STATIQUES PRÉ-RENDUS ====================
+
+# Parties fixes des documents (en-têtes, ligne de découpe, journal des consultations
+# vierge...), mises en page une fois par worker puis rejouées telles quelles :
+# clé -> (opérations PDF, polices, taille, décalage, espacements) ou None si le
+# bloc utilise des ressources qui ne peuvent pas être rejouées.
+_static_blocks = OrderedDict()
+_static_blocks_lock = threading.Lock()
+
+# Nom de police suivi de sa taille et de l'opérateur Tf, ex. "/F2 10 Tf"
+PDF_FONT_OPERATOR = re.compile(r"/F\d+(?= [\d.]+ Tf)")
+# Ressource propre au document : objet externe ("/FormXob.a1 Do") ou état graphique ("/gRLs0 gs")
+PDF_RESOURCE_OPERATOR = re.compile(r"^/\S+ (?:Do|gs)$", re.M)
+# Marge intérieure du cadre de SimpleDocTemplate (valeur par défaut de Frame)
+FRAME_PADDING = 6
+
+def _define_static_block():
+    """Classe StaticBlock, définie au chargement de ReportLab (voir load_pdf_stack)"""
+
+    class StaticBlock(Flowable):
+        """Bloc rejoué à partir des opérations de dessin enregistrées, sans mise en page.
+
+        Les opérations ont été capturées dans un cadre sans marge, le bas du bloc
+        à la hauteur offset ; seuls les noms internes des polices (/F1, /F2...)
+        propres à chaque document sont ré-attribués au moment du dessin.
+        """
+
+        def __init__(self, operations, fonts, width, height, offset, space_before, space_after):
+            Flowable.__init__(self)
+            self.operations = operations
+            self.fonts = fonts
+            self.width = width
+            self.height = height
+            self.offset = offset
+            self.spaceBefore = space_before
+            self.spaceAfter = space_after
+
+        def wrap(self, availWidth, availHeight):
+            return self.width, self.height
+
+        def draw(self):
+            canv = self.canv
+            names = {captured: canv._doc.getInternalFontName(psname) for captured, psname in self.fonts.items()}
+            canv.translate(0, -self.offset)
+            canv._code.append(PDF_FONT_OPERATOR.sub(lambda match: names[match.group()], self.operations))
+
+    return StaticBlock
+
+def static_block(key, width, build, height=None):
+    """Flowables fixes d'un document, larges de width, mis en page une seule fois par worker.
+
+    build() retourne les flowables du bloc et n'est appelée qu'au premier rendu :
+    la clé doit donc couvrir toutes les données dont ils dépendent. Avec height,
+    le bloc occupe exactement cette hauteur (page entière). Le résultat est une
+    liste contenant un StaticBlock, ou les flowables eux-mêmes si le bloc ne peut
+    pas être rejoué (image, transparence, débordement de la page).
+    """
+    cache_key = (key, width, height)
+    with _static_blocks_lock:
+        captured = _static_blocks.get(cache_key, False)
+        if captured is not False:
+            _static_blocks.move_to_end(cache_key)
+    if captured is False:
+        flowables = build()
+        frame_height = height or A4[1]
+        space_before = flowables[0].getSpaceBefore() if flowables and height is None else 0
+        capture = canvas.Canvas(io.BytesIO())
+        frame = Frame(0, 0, width, frame_height, leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)
+        frame.addFromList(flowables, capture)
+        operations = "\n".join(capture._code)
+        # Tout doit tenir dans le cadre, sans ressource propre au document (images, transparence)
+        captured = None
+        if not flowables and not PDF_RESOURCE_OPERATOR.search(operations):
+            fonts = {internal: psname for psname, internal in capture._doc.fontMapping.items()}
+            if height is None:
+                # Le bas du bloc est au-dessus de l'espace après le dernier flowable
+                offset = frame._y + frame._prevASpace
+                captured = (operations, fonts, width, frame_height - offset, offset, space_before, frame._prevASpace)
+            else:
+                captured = (operations, fonts, width, height, 0, 0, 0)
+        with _static_blocks_lock:
+            _static_blocks[cache_key] = captured
+            while len(_static_blocks) > app.config["PDF_STATIC_CACHE_ENTRIES"]:
+                _static_blocks.popitem(last=False)
+    if captured is None:
+        return build()
+    return [StaticBlock(*captured)]
 
-# Charger variables .env
-load_dotenv()
+def frame_width(doc):
+    """Largeur utile du cadre de page de SimpleDocTemplate"""
+    return doc.width - 2 * FRAME_PADDING
 
-app = Flask(__name__)
+def static_page(key, doc, build):
+    """Page entière de flowables fixes du document doc (doit suivre un saut de page), voir static_block"""
+    return static_block(key, frame_width(doc), build, height=doc.height - 2 * FRAME_PADDING)
 
-# Configurations
-app.config["UPLOAD_FOLDER"] = "static/uploads"
-app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key")
+# ==================== FILE DE RENDU PDF ASYNCHRONE ====================
 
-# Connexion MongoDB
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client[os.getenv("DB_NAME")]
+# L'état des tâches est stocké dans PDF_JOB_FOLDER (<id>.json + <id>.pdf) pour
+# que n'importe quel worker gunicorn de la machine puisse répondre au suivi.
+_job_executor = None
+_job_lock = threading.Lock()
+_jobs_in_flight = 0
 
-# Créer le dossier uploads
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
 
-# Fonction utilitaire pour formater les dates
-def format_date(date_str):
-    """Formate une date de YYYY-MM-DD à DD/MM/YYYY"""
-    if not date_str:
-        return ""
+def async_requested():
+    """Indique si la requête courante doit être rendue en tâche de fond"""
+    return app.config["PDF_ASYNC"] or request.args.get("async") == "1"
+
+def job_path(job_id, extension):
+    return os.path.join(app.config["PDF_JOB_FOLDER"], f"{job_id}{extension}")
+
+def read_job_state(job_id):
+    """Lit l'état d'une tâche, ou None si elle est inconnue"""
     try:
-        if "-" in date_str:
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-            return date_obj.strftime("%d/%m/%Y")
-        return date_str
-    except:
-        return date_str
+        with open(job_path(job_id, ".json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_job_state(job_id, **fields):
+    """Met à jour l'état d'une tâche de façon atomique"""
+    state = read_job_state(job_id) or {}
+    state.update(fields)
+    path = job_path(job_id, ".json")
+    with atomic_write(path, "w") as f:
+        json.dump(state, f)
+
+def run_pdf_job(job_id, generator, args):
+    """Exécuté dans un processus du pool : rend le PDF et l'écrit dans le dossier des tâches"""
+    try:
+        pdf_file = PDF_GENERATORS[generator](*args)
+        pdf_path = job_path(job_id, ".pdf")
+        with atomic_write(pdf_path) as out:
+            shutil.copyfileobj(pdf_file, out)
+        pdf_file.close()
+        write_job_state(job_id, status="done", finished=datetime.now().isoformat())
+    except Exception as e:
+        print(f"❌ Erreur tâche PDF {job_id}: {e}")
+        write_job_state(job_id, status="failed", error=str(e), finished=datetime.now().isoformat())
+
+def _job_finished(job_id, future):
+    """Fin d'une tâche côté worker : libère sa place et enregistre l'échec si le processus de rendu est mort"""
+    global _jobs_in_flight
+    with _job_lock:
+        _jobs_in_flight -= 1
+    # run_pdf_job enregistre lui-même ses erreurs Python ; une exception ici
+    # signifie que le processus a disparu (OOM, signal) ou que le pool est cassé
+    error = future.exception() if future is not None and not future.cancelled() else None
+    if error is not None:
+        print(f"❌ Tâche PDF {job_id} interrompue: {error!r}")
+        write_job_state(job_id, status="failed", error=str(error) or type(error).__name__,
+                        finished=datetime.now().isoformat())
+
+def get_job_executor():
+    """Pool de processus de rendu, créé à la première tâche de chaque worker.
+
+    Si un processus du pool est mort (OOM, signal), le pool est cassé et
+    refuserait toute nouvelle tâche : on repart sur un pool neuf.
+    """
+    global _job_executor
+    if _job_executor is not None and _job_executor._broken:
+        _job_executor.shutdown(wait=False)
+        _job_executor = None
+    if _job_executor is None:
+        # forkserver : le worker a déjà des threads (métriques, MongoDB, gthread) ;
+        # un fork pendant qu'ils tiennent un verrou bloquerait le processus enfant
+        _job_executor = ProcessPoolExecutor(max_workers=app.config["PDF_JOB_WORKERS"],
+                                            mp_context=multiprocessing.get_context("forkserver"))
+    return _job_executor
+
+def enqueue_pdf_job(generator, args, download_name):
+    """Place un rendu dans le pool et répond immédiatement avec l'identifiant de la tâche"""
+    global _jobs_in_flight
+    with _job_lock:
+        if _jobs_in_flight >= app.config["PDF_JOB_QUEUE_DEPTH"]:
+            response = jsonify({"error": "File de rendu pleine, réessayez plus tard"})
+            response.status_code = 503
+            response.headers["Retry-After"] = "5"
+            return response
+        _jobs_in_flight += 1
+
+    job_id = uuid.uuid4().hex
+    os.makedirs(app.config["PDF_JOB_FOLDER"], exist_ok=True)
+    write_job_state(job_id, status="pending", generator=generator,
+                    download_name=download_name, created=datetime.now().isoformat())
+    try:
+        future = get_job_executor().submit(run_pdf_job, job_id, generator, args)
+    except Exception:
+        _job_finished(job_id, None)
+        raise
+    future.add_done_callback(functools.partial(_job_finished, job_id))
+
+    response = jsonify({
+        "job_id": job_id,
+        "status": "pending",
+        "status_url": url_for("job_status", job_id=job_id),
+        "pdf_url": url_for("job_pdf", job_id=job_id),
+    })
+    response.status_code = 202
+    response.headers["Location"] = url_for("job_status", job_id=job_id)
+    phase_done("enqueue")
+    return response
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """État d'une tâche de rendu"""
+    state = read_job_state(job_id) if JOB_ID_PATTERN.fullmatch(job_id) else None
+    if state is None:
+        return jsonify({"error": "Tâche introuvable"}), 404
+    state["job_id"] = job_id
+    if state["status"] == "done":
+        state["pdf_url"] = url_for("job_pdf", job_id=job_id)
+    return jsonify(state)
+
+@app.route("/jobs/<job_id>/pdf")
+def job_pdf(job_id):
+    """PDF produit par une tâche terminée"""
+    state = read_job_state(job_id) if JOB_ID_PATTERN.fullmatch(job_id) else None
+    if state is None:
+        return jsonify({"error": "Tâche introuvable"}), 404
+    if state["status"] != "done":
+        return jsonify({"job_id": job_id, "status": state["status"], "error": state.get("error")}), 409
+    return send_file(job_path(job_id, ".pdf"), mimetype="application/pdf", as_attachment=True,
+                     download_name=state["download_name"])
+
+# ==================== STATISTIQUES ====================
+
+# Collections dont la page d'accueil affiche le nombre de documents
+STATS_COLLECTIONS = ("carnets", "factures")
+
+# Compteurs en cache par worker, rafraîchis au plus une fois par STATS_TTL
+_stats = {"counts": None, "expires": 0.0}
+_stats_lock = threading.Lock()
+
+def get_stats():
+    """Nombre de documents par collection, sans parcours de collection.
+
+    estimated_document_count() lit les métadonnées de la collection (0 si
+    elle n'existe pas encore) ; entre deux rafraîchissements, les insertions
+    et suppressions de ce worker sont répercutées par bump_stat().
+    """
+    with _stats_lock:
+        now = time.monotonic()
+        if _stats["counts"] is None or now >= _stats["expires"]:
+            _stats["counts"] = {name: db[name].estimated_document_count() for name in STATS_COLLECTIONS}
+            _stats["expires"] = now + app.config["STATS_TTL"]
+        return dict(_stats["counts"])
+
+def bump_stat(collection, delta=1):
+    """Répercute une insertion (+1) ou une suppression (-1) sur les compteurs en cache"""
+    with _stats_lock:
+        if _stats["counts"] is not None:
+            _stats["counts"][collection] = max(0, _stats["counts"][collection] + delta)
+
+# ==================== INDEX MONGODB ====================
+
+# Index déclarés par collection : (clés, options)
+INDEXES = {
+    "carnets": [
+        ([("date_creation", DESCENDING), ("_id", DESCENDING)], {"name": "date_creation_id"}),
+        ([("identification", ASCENDING)], {"name": "identification", "sparse": True}),
+        ([("species", ASCENDING), ("date_creation", DESCENDING)], {"name": "species_date_creation"}),
+        ([("proprietaire_nom", ASCENDING)], {"name": "proprietaire_nom"}),
+        ([("veterinaire_cabinet", ASCENDING)], {"name": "veterinaire_cabinet"}),
+        # Vérification des uploads orphelins par le ramasse-miettes
+        ([("photo", ASCENDING)], {"name": "photo", "sparse": True}),
+        ([("cachet", ASCENDING)], {"name": "cachet", "sparse": True}),
+        ([("signature", ASCENDING)], {"name": "signature", "sparse": True}),
+    ],
+    "factures": [
+        ([("numero_facture", ASCENDING)], {"name": "numero_facture"}),
+        ([("carnet_id", ASCENDING)], {"name": "carnet_id", "sparse": True}),
+        ([("date_creation", DESCENDING)], {"name": "date_creation"}),
+    ],
+    "attestations": [
+        ([("numero_attestation", ASCENDING)], {"name": "numero_attestation"}),
+        ([("animal_puce", ASCENDING)], {"name": "animal_puce", "sparse": True}),
+        ([("animal_id", ASCENDING)], {"name": "animal_id", "sparse": True}),
+        ([("date_creation", DESCENDING)], {"name": "date_creation"}),
+        ([("stamp_image", ASCENDING)], {"name": "stamp_image", "sparse": True}),
+        ([("signature_path", ASCENDING)], {"name": "signature_path", "sparse": True}),
+    ],
+    "cartes_identification": [
+        ([("numero_carte", ASCENDING)], {"name": "numero_carte"}),
+        ([("animalId", ASCENDING)], {"name": "animalId", "sparse": True}),
+        ([("date_creation", DESCENDING)], {"name": "date_creation"}),
+    ],
+    "uploads": [
+        ([("refs", ASCENDING)], {"name": "refs"}),
+    ],
+}
+
+# Formes de requêtes de l'application, vérifiées par `flask ensure-indexes --report`
+QUERY_SHAPES = [
+    ("carnets", "liste paginée", {}, [("date_creation", -1), ("_id", -1)]),
+    ("carnets", "page suivante", {"$or": [{"date_creation": {"$lt": datetime(2100, 1, 1)}},
+                                          {"date_creation": datetime(2100, 1, 1), "_id": {"$lt": ObjectId()}}]},
+     [("date_creation", -1), ("_id", -1)]),
+    ("carnets", "export par espèce", {"species": "Chat"}, [("date_creation", -1)]),
+    ("carnets", "export par propriétaire", {"proprietaire_nom": "x"}, [("date_creation", -1)]),
+    ("carnets", "export par cabinet", {"veterinaire_cabinet": "x"}, [("date_creation", -1)]),
+    ("carnets", "recherche par identification", {"identification": "x"}, None),
+    ("factures", "recherche par numéro", {"numero_facture": "x"}, None),
+    ("factures", "factures d'un carnet", {"carnet_id": "x"}, None),
+    ("attestations", "recherche par numéro", {"numero_attestation": "x"}, None),
+    ("attestations", "recherche par puce", {"animal_puce": "x"}, None),
+    ("attestations", "recherche par identification", {"animal_id": "x"}, None),
+    ("cartes_identification", "recherche par numéro", {"numero_carte": "x"}, None),
+    ("cartes_identification", "recherche par identification", {"animalId": "x"}, None),
+    ("cartes_identification", "planche par période", {"date_creation": {"$gte": datetime(2000, 1, 1)}},
+     [("date_creation", 1), ("_id", 1)]),
+    ("uploads", "uploads orphelins", {"refs": {"$lte": 0}}, None),
+    ("carnets", "références d'un upload", {"$or": [{field: "x"} for field in UPLOAD_FIELDS["carnets"]]}, None),
+    ("attestations", "références d'un upload", {"$or": [{field: "x"} for field in UPLOAD_FIELDS["attestations"]]}, None),
+]
+
+def ensure_indexes():
+    """Crée les index déclarés (sans effet s'ils existent déjà) ; retourne leurs noms par collection"""
+    created = {}
+    for collection, indexes in INDEXES.items():
+        models = [IndexModel(keys, **options) for keys, options in indexes]
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+def _plan_stages(plan):
+    """Étapes d'un plan d'exécution MongoDB, en profondeur"""
+    yield plan.get("stage")
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from _plan_stages(child)
+
+def collection_scan_report():
+    """Liste (collection, requête, index utilisé ou None) pour chaque forme de requête déclarée"""
+    report = []
+    for collection, label, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = list(_plan_stages(plan.get("queryPlan", plan)))
+        report.append((collection, label, "COLLSCAN" not in stages))
+    return report
+
+@app.cli.command("ensure-indexes")
+@click.option("--report", is_flag=True, help="Signaler les requêtes qui parcourraient toute la collection")
+def ensure_indexes_command(report):
+    """Crée les index MongoDB déclarés dans INDEXES"""
+    for collection, names in ensure_indexes().items():
+        click.echo(f"{collection}: {', '.join(names)}")
+    if report:
+        for collection, label, indexed in collection_scan_report():
+            click.echo(f"{'OK      ' if indexed else 'COLLSCAN'} {collection} - {label}")
+
+def ensure_indexes_at_startup():
+    """Crée les index si MONGO_ENSURE_INDEXES est activé.
+
+    Appelé par le hook when_ready de gunicorn (gunicorn.conf.py), une seule fois
+    dans le maître : à l'import du module, la création serait relancée par chaque
+    worker et chaque processus du pool de rendu.
+    """
+    if not app.config["MONGO_ENSURE_INDEXES"]:
+        return
+    try:
+        ensure_indexes()
+        print("✅ Index MongoDB créés")
+    except Exception as e:
+        print(f"❌ Erreur création des index: {e}")
+
+# ==================== RAMASSE-MIETTES DES FICHIERS ====================
+
+def _expired_files(folder, max_age, pattern=None):
+    """(chemin, taille) des fichiers d'un dossier plus anciens que max_age secondes"""
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        if pattern and not pattern.fullmatch(entry.name):
+            continue
+        stat = entry.stat()
+        if stat.st_mtime < limit:
+            yield entry.path, stat.st_size
+
+def _orphan_uploads(grace):
+    """(chemin, taille) des uploads dont le compteur de références est à zéro.
+
+    Seuls ces fichiers sont revérifiés auprès des carnets et attestations : un
+    compteur à zéro alors qu'un document référence encore le fichier (compteur
+    désynchronisé) ne suffit jamais à le supprimer.
+    """
+    limit = time.time() - grace
+    for record in db.uploads.find({"refs": {"$lte": 0}}, {"date_utilisation": 1}):
+        # Contenu réenvoyé récemment : le document qui va le référencer peut être en cours d'insertion
+        used = record.get("date_utilisation")
+        if used and used.timestamp() >= limit:
+            continue
+        path = os.path.join(app.config["UPLOAD_FOLDER"], record["_id"])
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime < limit and not upload_references(record["_id"]):
+            yield path, stat.st_size
+
+def sweep_candidates(legacy_tmp=False):
+    """Fichiers supprimables, par catégorie : {catégorie: [(chemin, taille), ...]}
+
+    - uploads : fichiers dont le compteur de références (collection uploads) est
+      à zéro et qu'aucun carnet ni attestation ne référence (les fichiers récents
+      sont épargnés : le document qui va les référencer peut être en cours
+      d'insertion) ;
+    - tmp : écritures atomiques interrompues (*.tmp) ;
+    - jobs : tâches de rendu asynchrone terminées depuis plus de GC_JOB_TTL ;
+    - variantes : variantes d'impression inutilisées depuis GC_VARIANT_TTL
+      (elles sont recréées à la demande) ;
+    - legacy_tmp : PDF tmp*.pdf laissés dans le dossier temporaire par les
+      anciennes versions qui passaient par NamedTemporaryFile.
+    """
+    grace = app.config["GC_GRACE_SECONDS"]
+    tmp_pattern = re.compile(r".+\.tmp")
+    candidates = {
+        "uploads": list(_orphan_uploads(grace)),
+        "tmp": [item for folder in (app.config["UPLOAD_FOLDER"], app.config["PDF_VARIANT_FOLDER"], app.config["PDF_JOB_FOLDER"])
+                for item in _expired_files(folder, grace, tmp_pattern)],
+        "jobs": list(_expired_files(app.config["PDF_JOB_FOLDER"], app.config["GC_JOB_TTL"],
+                                    re.compile(r"[0-9a-f]{32}\.(json|pdf)"))),
+        "variantes": list(_expired_files(app.config["PDF_VARIANT_FOLDER"], app.config["GC_VARIANT_TTL"],
+                                         re.compile(r".+\.(jpg|png)"))),
+    }
+    if legacy_tmp:
+        candidates["legacy_tmp"] = list(_expired_files(tempfile.gettempdir(), grace, re.compile(r"tmp\w+\.pdf")))
+    return candidates
+
+def sweep_files(batch_size=None, dry_run=False, legacy_tmp=False, log=print):
+    """Supprime les fichiers orphelins ou expirés par lots et retourne {catégorie: (fichiers, octets)}"""
+    batch_size = batch_size or app.config["GC_BATCH_SIZE"]
+    report = {}
+    for category, files in sweep_candidates(legacy_tmp).items():
+        removed = reclaimed = 0
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            names = []
+            for path, size in batch:
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                names.append(os.path.basename(path))
+                removed += 1
+                reclaimed += size
+            if category == "uploads" and names and not dry_run:
+                db.uploads.delete_many({"_id": {"$in": names}, "refs": {"$lte": 0}})
+            if len(files) > batch_size:
+                log(f"... {category}: {removed}/{len(files)} fichiers")
+        report[category] = (removed, reclaimed)
+    return report
+
+@app.cli.command("sweep-files")
+@click.option("--batch-size", type=int, default=None, help="Fichiers supprimés par lot (défaut : GC_BATCH_SIZE)")
+@click.option("--dry-run", is_flag=True, help="Lister ce qui serait supprimé sans rien supprimer")
+@click.option("--legacy-tmp", is_flag=True, help="Inclure les PDF tmp*.pdf des anciennes versions")
+def sweep_files_command(batch_size, dry_run, legacy_tmp):
+    """Supprime les uploads orphelins et les fichiers de rendu expirés"""
+    report = sweep_files(batch_size, dry_run, legacy_tmp, log=click.echo)
+    for category, (removed, reclaimed) in report.items():
+        click.echo(f"{category}: {removed} fichiers, {reclaimed} octets")
+    total = sum(reclaimed for _, reclaimed in report.values())
+    click.echo(f"{'Récupérable' if dry_run else 'Récupéré'} : {total} octets ({total / 1024 / 1024:.1f} Mo)")
+
+def _sweeper_loop(interval):
+    """Boucle du nettoyage périodique ; un seul worker de la machine nettoie à chaque passage"""
+    lock_path = os.path.join(tempfile.gettempdir(), "carnet-sante-sweep.lock")
+    while True:
+        time.sleep(interval)
+        try:
+            with open(lock_path, "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                report = sweep_files()
+                total = sum(reclaimed for _, reclaimed in report.values())
+                print(f"✅ Nettoyage des fichiers : {sum(removed for removed, _ in report.values())} "
+                      f"fichiers, {total} octets récupérés")
+        except Exception as e:
+            print(f"❌ Erreur nettoyage des fichiers: {e}")
+
+# Processus dans lequel le nettoyage périodique a été démarré
+_sweeper_pid = None
+
+@app.before_request
+def start_sweeper():
+    """Démarre le nettoyage périodique (si GC_INTERVAL est défini) à la première requête du worker.
+
+    Pas au chargement du module : avec gunicorn --preload, un thread démarré
+    dans le processus maître ne survivrait pas au fork des workers.
+    """
+    global _sweeper_pid
+    interval = app.config["GC_INTERVAL"]
+    if interval > 0 and _sweeper_pid != os.getpid():
+        _sweeper_pid = os.getpid()
+        threading.Thread(target=_sweeper_loop, args=(interval,), name="sweeper", daemon=True).start()
+
+# ==================== MESURE DES PHASES DES REQUÊTES ====================
+
+@app.before_request
+def start_phases():
+    """Démarre le chronométrage des phases de la requête (si SERVER_TIMING est activé)"""
+    if app.config["SERVER_TIMING"]:
+        g.request_started = g.phase_started = time.perf_counter()
+        g.phases = []
+
+def phase_done(name):
+    """Clôt la phase name : durée écoulée depuis la fin de la phase précédente.
+
+    Sans SERVER_TIMING, l'appel se limite à la lecture de la configuration.
+    """
+    if app.config["SERVER_TIMING"]:
+        now = time.perf_counter()
+        g.phases.append((name, now - g.phase_started))
+        g.phase_started = now
+
+@app.after_request
+def report_phases(response):
+    """Expose les phases mesurées dans l'en-tête Server-Timing et dans un log JSON"""
+    phases = g.get("phases") if app.config["SERVER_TIMING"] else None
+    if phases:
+        total = time.perf_counter() - g.request_started
+        response.headers["Server-Timing"] = ", ".join(
+            [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases] + [f"total;dur={total * 1000:.1f}"])
+        print(json.dumps({"event": "request_phases", "method": request.method, "path": request.path,
+                          "status": response.status_code, "total_ms": round(total * 1000, 1),
+                          "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases}}))
+    return response
+
+# ==================== LECTURE DES TABLEAUX DE FORMULAIRE ====================
+
+def form_number(value):
+    """Nombre saisi dans un formulaire (virgule décimale acceptée, 0 si vide).
+
+    Lève ValueError si la saisie n'est pas un nombre fini.
+    """
+    number = float(value.replace(",", ".").strip() or 0)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+# Tableaux dynamiques des formulaires (champs nom[i][champ]) :
+# nom -> (champ obligatoire, {champ: conversion})
+FORM_ARRAYS = {
+    "vaccins": ("type", {"type": str.strip, "date": str.strip, "rappel": str.strip, "lot": str.strip}),
+    "antiparasitaires": ("type", {"type": str.strip, "date": str.strip, "produit": str.strip,
+                                  "prochaine_date": str.strip}),
+    "items": ("description", {"description": str.strip, "quantite": form_number, "prix": form_number}),
+}
+
+def parse_form_arrays(form, names):
+    """Reconstruit les tableaux déclarés dans FORM_ARRAYS en un seul parcours du formulaire.
+
+    Les lignes sont triées par indice, sans s'arrêter aux trous : une ligne
+    supprimée au milieu du formulaire n'entraîne plus la perte des suivantes.
+    Les lignes dont le champ obligatoire est vide sont ignorées ; une valeur
+    non convertible lève ValueError en nommant le champ (ex. items[2][prix]).
+    """
+    rows = {name: {} for name in names}
+    schemas = {name: FORM_ARRAYS[name][1] for name in names}
+    for key, value in form.items():
+        # "nom[i][champ]" découpé sans expression régulière : c'est la boucle chaude
+        name, bracket, rest = key.partition("[")
+        indexed = rows.get(name)
+        if indexed is None or not bracket:
+            continue
+        index, separator, field = rest.partition("][")
+        field = field[:-1]
+        # isdecimal() seul accepterait des chiffres non ASCII ("٣")
+        if separator and field in schemas[name] and index.isascii() and index.isdecimal():
+            row = indexed.get(index)
+            if row is None:
+                row = indexed[index] = {}
+            row[field] = value
+    arrays = {}
+    for name, indexed in rows.items():
+        required, fields = FORM_ARRAYS[name]
+        arrays[name] = []
+        for index, row in sorted(indexed.items(), key=lambda item: int(item[0])):
+            if not row.get(required, "").strip():
+                continue
+            entry = {}
+            for field, convert in fields.items():
+                try:
+                    entry[field] = convert(row.get(field, ""))
+                except ValueError:
+                    raise ValueError(f"{name}[{index}][{field}] : valeur invalide « {row[field]} »") from None
+            arrays[name].append(entry)
+    return arrays
+
+@app.cli.command("bench-form")
+@click.option("--rows", default=500, show_default=True, help="Lignes par tableau (vaccins, antiparasitaires, articles)")
+@click.option("--repeat", default=50, show_default=True)
+def bench_form_command(rows, repeat):
+    """Compare l'ancienne lecture des tableaux (sondage indice par indice) et parse_form_arrays()"""
+    from werkzeug.datastructures import ImmutableMultiDict
+
+    fields = [("name", "Rex"), ("species", "Chien"), ("entreprise_nom", "Transports")]
+    for i in range(rows):
+        fields += [(f"vaccins[{i}][type]", f"Vaccin {i}"), (f"vaccins[{i}][date]", "2024-01-15"),
+                   (f"vaccins[{i}][rappel]", "2025-01-15"), (f"vaccins[{i}][lot]", f"L{i}"),
+                   (f"antiparasitaires[{i}][type]", "Vermifuge"), (f"antiparasitaires[{i}][date]", "2024-02-01"),
+                   (f"antiparasitaires[{i}][produit]", f"P{i}"), (f"antiparasitaires[{i}][prochaine_date]", "2024-05-01"),
+                   (f"items[{i}][description]", f"Trajet {i}"), (f"items[{i}][quantite]", "2"), (f"items[{i}][prix]", "45.5")]
+    form = ImmutableMultiDict(fields)
+
+    def probing():
+        # Ancienne lecture : un sondage par indice et par champ, float() appelé deux fois par article
+        arrays = {}
+        for name, (required, schema) in FORM_ARRAYS.items():
+            arrays[name] = []
+            i = 0
+            while f"{name}[{i}][{required}]" in form:
+                entry = {field: form.get(f"{name}[{i}][{field}]", "").strip() for field in schema}
+                if name == "items":
+                    entry["quantite"] = float(form.get(f"items[{i}][quantite]", 0))
+                    entry["prix"] = float(form.get(f"items[{i}][prix]", 0))
+                    entry["total"] = float(form.get(f"items[{i}][quantite]", 0)) * float(form.get(f"items[{i}][prix]", 0))
+                if entry[required]:
+                    arrays[name].append(entry)
+                i += 1
+        return arrays
+
+    def single_pass():
+        arrays = parse_form_arrays(form, tuple(FORM_ARRAYS))
+        for item in arrays["items"]:
+            item["total"] = item["quantite"] * item["prix"]
+        return arrays
+
+    assert probing() == single_pass()
+    for label, func in (("sondage par indice", probing), ("parcours unique", single_pass)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        click.echo(f"{label:<20} {(time.perf_counter() - started) / repeat * 1000:.2f} ms "
+                   f"({len(form)} champs, {rows} lignes x 3 tableaux)")
 
 # ==================== ROUTES PAGES D'ACCUEIL ET NAVIGATION ====================
 
@@ -77,18 +2216,12 @@ def attestation_file():
 @app.route("/")
 def home():
     """Page d'accueil avec toutes les fonctionnalités"""
-    # Récupérer quelques statistiques
-    carnets_count = db.carnets.count_documents({})
-    
-    # Vérifier si la collection factures existe
-    if 'factures' in db.list_collection_names():
-        factures_count = db.factures.count_documents({})
-    else:
-        factures_count = 0
+    # Récupérer quelques statistiques (compteurs en cache)
+    stats = get_stats()
     
     return render_template("home.html", 
-                         carnets_count=carnets_count,
-                         factures_count=factures_count)
+                         carnets_count=stats["carnets"],
+                         factures_count=stats["factures"])
 
 @app.route("/dashboard")
 @app.route("/accueil")
@@ -136,24 +2269,35 @@ def generer_carte_identification():
             "date_creation": datetime.now(),
             "numero_carte": f"CART-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}",
         }
+        phase_done("parse")
         
         # Sauvegarde dans MongoDB
         inserted = db.cartes_identification.insert_one(data)
+        phase_done("db")
         
-        # Déterminer quelle partie générer
-        partie = request.form.get("partie", "complete")
+        # Déterminer quelles parties générer : plusieurs parties sont rendues
+        # ensemble et renvoyées dans une seule archive ZIP
+        parties = carte_parties(request.form.getlist("partie"))
         
-        if partie == "haute":
-            pdf_path = generate_carte_identification_haute(data, str(inserted.inserted_id))
-            nom_fichier = f"Carte_Identification_Haute_{data['animalName'].replace(' ', '_')}.pdf"
-        elif partie == "basse":
-            pdf_path = generate_carte_identification_basse(data, str(inserted.inserted_id))
-            nom_fichier = f"Carte_Identification_Basse_{data['animalName'].replace(' ', '_')}.pdf"
-        else:
-            pdf_path = generate_carte_identification_complete(data, str(inserted.inserted_id))
-            nom_fichier = f"Carte_Identification_Complete_{data['animalName'].replace(' ', '_')}.pdf"
+        if len(parties) > 1:
+            archive_file = generate_cartes_identification(data, str(inserted.inserted_id), parties)
+            phase_done("render")
+            nom_fichier = f"Cartes_Identification_{data['animalName'].replace(' ', '_')}.zip"
+            response = send_pdf(archive_file, nom_fichier, mimetype="application/zip")
+            phase_done("response")
+            return response
+        
+        partie = parties[0]
+        nom_fichier = carte_filename(partie, data)
+        
+        if async_requested():
+            return enqueue_pdf_job(f"carte_{partie}", (data, str(inserted.inserted_id)), nom_fichier)
         
-        return send_file(pdf_path, as_attachment=True, download_name=nom_fichier)
+        pdf_file = PDF_GENERATORS[f"carte_{partie}"](data, str(inserted.inserted_id))
+        phase_done("render")
+        response = send_pdf(pdf_file, nom_fichier)
+        phase_done("response")
+        return response
         
     except Exception as e:
         print(f"Erreur génération carte identification: {e}")
@@ -212,42 +2356,34 @@ def generer_attestation():
             
             "date_creation": datetime.now()
         }
+        phase_done("parse")
         
         # Gestion de l'upload du cachet
         if 'stamp-file' in request.files and request.files['stamp-file'].filename != '':
-            stamp_file = request.files['stamp-file']
-            filename = secure_filename(f"cachet_attestation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
-            stamp_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            stamp_file.save(stamp_path)
-            data["stamp_image"] = stamp_path
+            data["stamp_image"] = ingest_image(request.files['stamp-file'].stream, "cachet")
         
         # Gestion de la signature (maintenant dans les données du formulaire)
-        if 'signature-data' in request.form and request.form['signature-data']:
-            signature_data = request.form['signature-data']
-            if signature_data.startswith('data:image'):
-                try:
-                    header, encoded = signature_data.split(",", 1)
-                    signature_binary = base64.b64decode(encoded)
-                    
-                    filename = f"signature_attestation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                    signature_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                    
-                    with open(signature_path, 'wb') as f:
-                        f.write(signature_binary)
-                    data["signature_path"] = signature_path
-                except Exception as e:
-                    print(f"Erreur signature attestation: {e}")
+        data["signature_path"] = save_signature(request.form.get('signature-data', ''))
+        phase_done("upload")
         
         # Sauvegarde dans MongoDB (collection attestations)
         inserted = db.attestations.insert_one(data)
-        
-        # Générer le PDF de l'attestation
-        pdf_path = generate_attestation_pdf(data, str(inserted.inserted_id))
+        retain_uploads("attestations", data)
+        phase_done("db")
         
         # Nom du fichier PDF
         nom_fichier = f"Attestation_Veterinaire_{data['animal_name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.pdf"
         
-        return send_file(pdf_path, as_attachment=True, download_name=nom_fichier)
+        if async_requested():
+            return enqueue_pdf_job("attestation", (data, str(inserted.inserted_id)), nom_fichier)
+        
+        # Générer le PDF de l'attestation
+        pdf_file = generate_attestation_pdf(data, str(inserted.inserted_id))
+        phase_done("render")
+        
+        response = send_pdf(pdf_file, nom_fichier)
+        phase_done("response")
+        return response
         
     except Exception as e:
         print(f"Erreur génération attestation: {e}")
@@ -281,7 +2417,6 @@ def save():
             "attestation_ordre": request.form.get("attestation_ordre", "").strip(),
             "attestation_validite": request.form.get("attestation_validite", "").strip(),
             "attestation_observations": request.form.get("attestation_observations", "").strip(),
-            "signature_data": request.form.get("signature_data", "").strip(),
             
             # Propriétaire
             "proprietaire_nom": request.form.get("proprietaire_nom", "").strip(),
@@ -311,100 +2446,257 @@ def save():
             "date_creation": datetime.now()
         }
         
-        # Récupération des vaccinations
-        i = 0
-        while f"vaccins[{i}][type]" in request.form:
-            vaccin = {
-                "type": request.form.get(f"vaccins[{i}][type]", "").strip(),
-                "date": request.form.get(f"vaccins[{i}][date]", "").strip(),
-                "rappel": request.form.get(f"vaccins[{i}][rappel]", "").strip(),
-                "lot": request.form.get(f"vaccins[{i}][lot]", "").strip()
-            }
-            if vaccin["type"]:
-                data["vaccins"].append(vaccin)
-            i += 1
-        
-        # Récupération des antiparasitaires
-        j = 0
-        while f"antiparasitaires[{j}][type]" in request.form:
-            antipara = {
-                "type": request.form.get(f"antiparasitaires[{j}][type]", "").strip(),
-                "date": request.form.get(f"antiparasitaires[{j}][date]", "").strip(),
-                "produit": request.form.get(f"antiparasitaires[{j}][produit]", "").strip(),
-                "prochaine_date": request.form.get(f"antiparasitaires[{j}][prochaine_date]", "").strip()
-            }
-            if antipara["type"]:
-                data["antiparasitaires"].append(antipara)
-            j += 1
+        # Récupération des vaccinations et antiparasitaires (tableaux dynamiques)
+        data.update(parse_form_arrays(request.form, ("vaccins", "antiparasitaires")))
+        phase_done("parse")
         
         # Gestion de l'upload de la photo
         if 'photo' in request.files and request.files['photo'].filename != '':
-            photo_file = request.files['photo']
-            filename = secure_filename(f"photo_{data['name']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{photo_file.filename.split('.')[-1]}")
-            photo_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            photo_file.save(photo_path)
-            
-            # Redimensionner la photo
-            img = PILImage.open(photo_path)
-            img.thumbnail((800, 800))
-            img.save(photo_path)
-            data["photo"] = photo_path
+            data["photo"] = ingest_image(request.files['photo'].stream, "photo")
         
         # Gestion de l'upload du cachet
         if 'cachet' in request.files and request.files['cachet'].filename != '':
-            cachet_file = request.files['cachet']
-            filename = secure_filename(f"cachet_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
-            cachet_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            cachet_file.save(cachet_path)
-            data["cachet"] = cachet_path
+            data["cachet"] = ingest_image(request.files['cachet'].stream, "cachet")
         
-        # Gestion de la signature
-        if data["signature_data"] and data["signature_data"].startswith('data:image'):
-            try:
-                header, encoded = data["signature_data"].split(",", 1)
-                signature_binary = base64.b64decode(encoded)
-                
-                filename = f"signature_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                signature_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                
-                with open(signature_path, 'wb') as f:
-                    f.write(signature_binary)
-                data["signature"] = signature_path
-            except Exception as e:
-                print(f"Erreur signature: {e}")
+        # Gestion de la signature (seul le fichier PNG est conservé)
+        data["signature"] = save_signature(request.form.get("signature_data", "").strip())
+        phase_done("upload")
         
         # Sauvegarde dans MongoDB
         inserted = db.carnets.insert_one(data)
+        bump_stat("carnets")
+        retain_uploads("carnets", data)
+        phase_done("db")
+        
+        nom_fichier = f"Carnet_Sante_{data['name'].replace(' ', '_')}.pdf"
+        
+        if async_requested():
+            return enqueue_pdf_job("carnet", (data, str(inserted.inserted_id)), nom_fichier)
         
         # Générer le PDF du CARNET DE SANTÉ
-        pdf_path = generate_health_book_pdf(data, str(inserted.inserted_id))
+        pdf_file = generate_health_book_pdf(data, str(inserted.inserted_id))
+        phase_done("render")
         
-        return send_file(pdf_path, as_attachment=True, 
-                        download_name=f"Carnet_Sante_{data['name'].replace(' ', '_')}.pdf")
+        response = send_pdf(pdf_file, nom_fichier)
+        phase_done("response")
+        return response
         
     except Exception as e:
         print(f"Erreur: {e}")
         return f"Erreur lors de la sauvegarde: {str(e)}", 500
 
+# Champs affichés par la liste des carnets et le sélecteur de la facture
+CARNET_LIST_PROJECTION = {"name": 1, "species": 1, "proprietaire_nom": 1, "date_creation": 1}
+
+def encode_page_cursor(carnet):
+    """Curseur de pagination : position (date_creation, _id) du dernier carnet affiché"""
+    return f"{carnet['date_creation'].isoformat()}_{carnet['_id']}"
+
+def decode_page_cursor(cursor):
+    """Filtre MongoDB des carnets situés après le curseur (tri décroissant)"""
+    date_str, _, id_str = cursor.rpartition("_")
+    date_creation = datetime.fromisoformat(date_str)
+    carnet_id = ObjectId(id_str)
+    return {"$or": [
+        {"date_creation": {"$lt": date_creation}},
+        {"date_creation": date_creation, "_id": {"$lt": carnet_id}},
+    ]}
+
+def paginate_carnets(cursor=None, projection=CARNET_LIST_PROJECTION):
+    """Retourne une page de carnets (du plus récent au plus ancien) et le curseur de la page suivante"""
+    page_size = app.config["CARNETS_PAGE_SIZE"]
+    query = {}
+    if cursor:
+        try:
+            query = decode_page_cursor(cursor)
+        except Exception:
+            query = {}
+    carnets = list(db.carnets.find(query, projection)
+                   .sort([("date_creation", -1), ("_id", -1)])
+                   .limit(page_size + 1))
+    next_cursor = None
+    if len(carnets) > page_size:
+        carnets = carnets[:page_size]
+        next_cursor = encode_page_cursor(carnets[-1])
+    return carnets, next_cursor
+
 @app.route("/carnets")
 def liste_carnets():
-    """Liste tous les carnets"""
-    carnets = list(db.carnets.find().sort("date_creation", -1))
-    return render_template("liste.html", carnets=carnets)
+    """Liste paginée des carnets"""
+    carnets, next_cursor = paginate_carnets(request.args.get("apres"))
+    return render_template("liste.html", carnets=carnets, next_cursor=next_cursor,
+                           is_first_page=not request.args.get("apres"))
+
+@app.route("/carnet/<id>/pdf")
+def carnet_pdf(id):
+    """Regénère le PDF d'un carnet existant à partir de son document MongoDB"""
+    try:
+        carnet = db.carnets.find_one({"_id": ObjectId(id)})
+    except Exception:
+        carnet = None
+    if not carnet:
+        return "Carnet introuvable", 404
+    phase_done("db")
+
+    key = carnet_cache_key(carnet)
+    pdf_bytes = pdf_cache_get(key)
+    phase_done("cache")
+    if pdf_bytes is None:
+        pdf_file = generate_health_book_pdf(carnet, id)
+        pdf_bytes = pdf_file.read()
+        pdf_file.close()
+        pdf_cache_put(key, pdf_bytes)
+        phase_done("render")
+
+    response = send_pdf(io.BytesIO(pdf_bytes),
+                        f"Carnet_Sante_{carnet.get('name', '').replace(' ', '_')}.pdf")
+    response.set_etag(key)
+    response = response.make_conditional(request)
+    phase_done("response")
+    return response
 
 @app.route("/delete/<id>")
 def delete_carnet(id):
     """Supprimer un carnet"""
-    db.carnets.delete_one({"_id": ObjectId(id)})
+    carnet = db.carnets.find_one_and_delete({"_id": ObjectId(id)}, projection=list(UPLOAD_FIELDS["carnets"]))
+    if carnet:
+        bump_stat("carnets", -1)
+        release_uploads("carnets", carnet)
     return redirect(url_for("liste_carnets"))
 
+# ==================== EXPORT GROUPÉ DES CARNETS ====================
+
+# Filtres acceptés par l'export (paramètre -> champ du carnet)
+EXPORT_FILTERS = {
+    "species": "species",
+    "proprietaire": "proprietaire_nom",
+    "cabinet": "veterinaire_cabinet",
+    "identification": "identification",
+}
+
+def date_creation_range(params):
+    """Filtre sur date_creation pour ?depuis= et ?jusqu= (AAAA-MM-JJ, jours inclus), ou None.
+
+    Lève ValueError si une date est invalide.
+    """
+    periode = {}
+    if params.get("depuis"):
+        periode["$gte"] = datetime.strptime(params["depuis"], "%Y-%m-%d")
+    if params.get("jusqu"):
+        # Tout le dernier jour : jusqu'au lendemain minuit exclu
+        periode["$lt"] = datetime.strptime(params["jusqu"], "%Y-%m-%d") + timedelta(days=1)
+    return periode or None
+
+def carnets_export_query(params):
+    """Construit le filtre MongoDB de l'export à partir des paramètres fournis"""
+    query = {field: params[name] for name, field in EXPORT_FILTERS.items() if params.get(name)}
+    periode = date_creation_range(params)
+    if periode:
+        query["date_creation"] = periode
+    return query
+
+def render_carnet_for_export(carnet):
+    """Exécuté dans le pool : rend un carnet et retourne (nom dans l'archive, octets)"""
+    carnet_id = str(carnet["_id"])
+    pdf_file = generate_health_book_pdf(carnet, carnet_id)
+    pdf_bytes = pdf_file.read()
+    pdf_file.close()
+    name = secure_filename(f"Carnet_Sante_{carnet.get('name') or 'Animal'}_{carnet_id}.pdf")
+    return name, pdf_bytes
+
+def render_carnets_parallel(carnets):
+    """Rend les carnets dans le pool de processus et les produit dans l'ordre de fin de rendu.
+
+    Le nombre de rendus soumis à la fois est borné pour ne jamais garder plus
+    de quelques PDF en mémoire, quel que soit le nombre de carnets. Chaque
+    future porte l'attribut carnet_label ("<id> <nom>") pour les messages d'erreur.
+    """
+    window = 2 * app.config["PDF_JOB_WORKERS"]
+    pending = set()
+    for carnet in carnets:
+        future = get_job_executor().submit(render_carnet_for_export, carnet)
+        future.carnet_label = f"{carnet['_id']} {carnet.get('name') or 'Animal'}"
+        pending.add(future)
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        yield from done
+
+class _ZipStream:
+    """Flux en écriture seule : zipfile y écrit, on vide les octets au fil de l'eau"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_carnets_zip(query):
+    """Produit une archive ZIP des carnets correspondant au filtre, morceau par morceau"""
+    stream = _ZipStream()
+    errors = []
+    # Les PDF sont déjà compressés : on les stocke tels quels
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        carnets = db.carnets.find(query, {"signature_data": 0}).sort("date_creation", -1)
+        for future in render_carnets_parallel(carnets):
+            try:
+                name, pdf_bytes = future.result()
+            except Exception as e:
+                errors.append(f"{future.carnet_label}: {e}")
+                continue
+            archive.writestr(name, pdf_bytes)
+            yield stream.drain()
+        if errors:
+            archive.writestr("ERREURS.txt", "\n".join(errors))
+    yield stream.drain()
+
+@app.route("/carnets/export")
+def export_carnets():
+    """Exporte en ZIP les carnets filtrés (?species=, ?proprietaire=, ?cabinet=, ?depuis=, ?jusqu=)"""
+    try:
+        query = carnets_export_query(request.args)
+    except ValueError:
+        return "Dates invalides (format attendu : AAAA-MM-JJ)", 400
+    nom_fichier = f"Carnets_Sante_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(stream_with_context(iter_carnets_zip(query)), mimetype="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{nom_fichier}"'})
+
+@app.cli.command("export-carnets")
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option("--species", help="Espèce")
+@click.option("--proprietaire", help="Nom du propriétaire")
+@click.option("--cabinet", help="Cabinet vétérinaire")
+@click.option("--identification", help="Numéro d'identification")
+@click.option("--depuis", help="Créés à partir du (AAAA-MM-JJ)")
+@click.option("--jusqu", help="Créés jusqu'au (AAAA-MM-JJ)")
+def export_carnets_command(output, **params):
+    """Exporte les carnets filtrés dans une archive ZIP"""
+    query = carnets_export_query(params)
+    size = 0
+    with open(output, "wb") as f:
+        for chunk in iter_carnets_zip(query):
+            f.write(chunk)
+            size += len(chunk)
+    click.echo(f"Archive écrite : {output} ({size} octets)")
+
 # ==================== ROUTES FACTURES ====================
 
 @app.route("/facture/nouvelle")
 def nouvelle_facture():
     """Page pour créer une nouvelle facture"""
-    carnets = list(db.carnets.find().sort("date_creation", -1))
-    return render_template("facture_form.html", carnets=carnets, carnet=None, 
+    # Le formulaire ne liste pas les carnets : aucune requête MongoDB
+    return render_template("facture_form.html", carnet=None, 
                           carnet_id=None, today=datetime.now().strftime('%Y-%m-%d'))
 
 @app.route("/facture/<carnet_id>")
@@ -466,18 +2758,13 @@ def generer_facture():
             "numero_facture": f"FAC-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}"
         }
         
-        # Récupérer les articles
-        i = 0
-        while f"items[{i}][description]" in request.form:
-            item = {
-                "description": request.form.get(f"items[{i}][description]", ""),
-                "quantite": float(request.form.get(f"items[{i}][quantite]", 0)),
-                "prix": float(request.form.get(f"items[{i}][prix]", 0)),
-                "total": float(request.form.get(f"items[{i}][quantite]", 0)) * float(request.form.get(f"items[{i}][prix]", 0))
-            }
-            if item["description"]:
-                facture_data["items"].append(item)
-            i += 1
+        # Récupérer les articles (prix ou quantité illisible : formulaire refusé)
+        try:
+            facture_data["items"] = parse_form_arrays(request.form, ("items",))["items"]
+        except ValueError as e:
+            return f"Formulaire invalide : {e}", 400
+        for item in facture_data["items"]:
+            item["total"] = item["quantite"] * item["prix"]
         
         # Calculer les totaux
         sous_total = sum(item["total"] for item in facture_data["items"])
@@ -489,6 +2776,7 @@ def generer_facture():
             "tva": tva,
             "total_ttc": total_ttc
         }
+        phase_done("parse")
         
         # Récupérer les infos du carnet si disponible
         if facture_data["carnet_id"]:
@@ -510,15 +2798,23 @@ def generer_facture():
         
         # Sauvegarder dans la base de données
         inserted = db.factures.insert_one(facture_data)
+        bump_stat("factures")
         facture_data["_id"] = str(inserted.inserted_id)
-        
-        # Générer le PDF
-        pdf_path = generate_facture_pdf(facture_data)
+        phase_done("db")
         
         # Nom du fichier
         nom_fichier = f"Facture_{facture_data['numero_facture']}_{facture_data.get('animal', {}).get('nom', 'Animal')}.pdf"
         
-        return send_file(pdf_path, as_attachment=True, download_name=nom_fichier)
+        if async_requested():
+            return enqueue_pdf_job("facture", (facture_data,), nom_fichier)
+        
+        # Générer le PDF
+        pdf_file = generate_facture_pdf(facture_data)
+        phase_done("render")
+        
+        response = send_pdf(pdf_file, nom_fichier)
+        phase_done("response")
+        return response
         
     except Exception as e:
         print(f"Erreur génération facture: {e}")
@@ -526,15 +2822,17 @@ def generer_facture():
 
 # ==================== FONCTIONS DE GÉNÉRATION PDF CARTE IDENTIFICATION ====================
 
+@measure_render("carte_complete")
+@needs_pdf_stack
 def generate_carte_identification_complete(data, carte_id):
     """Génère la carte d'identification complète (haute + basse)"""
     
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    pdf_path = temp_file.name
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
     
     # Configuration du document
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=A4,
         topMargin=1*cm,
         bottomMargin=1*cm,
@@ -544,78 +2842,30 @@ def generate_carte_identification_complete(data, carte_id):
     )
     
     story = []
-    styles = getSampleStyleSheet()
-    
-    # Couleurs officielles
-    COLOR_PRIMARY = colors.black
-    COLOR_SECONDARY = colors.HexColor('#666666')
+    theme = get_theme("carte")
+    st = theme["styles"]
     
     # Styles
-    style_entreprise = ParagraphStyle(
-        name='Entreprise',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=COLOR_PRIMARY,
-        alignment=1,
-        fontName='Helvetica-Bold'
-    )
-    
-    style_normal = ParagraphStyle(
-        name='Normal',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=COLOR_PRIMARY,
-        alignment=0,
-        leading=10
-    )
-    
-    style_label = ParagraphStyle(
-        name='Label',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=COLOR_PRIMARY,
-        fontName='Helvetica-Bold',
-        spaceAfter=1
-    )
-    
-    style_value = ParagraphStyle(
-        name='Value',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=COLOR_PRIMARY
-    )
-    
-    style_login = ParagraphStyle(
-        name='Login',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=COLOR_PRIMARY,
-        fontName='Helvetica-Bold',
-        alignment=1,
-        backColor=colors.HexColor('#F0F0F0'),
-        borderPadding=6
-    )
-    
-    style_section = ParagraphStyle(
-        name='Section',
-        parent=styles['Heading2'],
-        fontSize=10,
-        textColor=COLOR_PRIMARY,
-        fontName='Helvetica-Bold',
-        spaceAfter=5,
-        spaceBefore=10
-    )
+    style_entreprise = st['Entreprise']
+    style_normal = st['Normal']
+    style_label = st['Label']
+    style_value = st['Value']
+    style_login = st['Login']
+    style_section = st['Section']
     
     # ===== PARTIE HAUTE =====
     
+    # Largeur du cadre des blocs fixes (mis en page une fois par worker)
+    width = frame_width(doc)
+    
     # En-tête officiel
     header_text = "SOCIÉTÉ D'IDENTIFICATION DES CARNIVORES DOMESTIQUES<br/>112-114 Avenue Gabriel Péri - 94246 L'HAY LES ROSES Cedex<br/><b>0 810 778 778</b>"
-    story.append(Paragraph(header_text, style_entreprise))
-    story.append(Spacer(1, 0.3*cm))
+    story.extend(static_block("carte_complete_entete", width,
+                              lambda: [Paragraph(header_text, style_entreprise), Spacer(1, 0.3*cm)]))
     
     # Date
     date_heure = data['date_creation'].strftime('%d/%m/%Y %H:%M:%S')
-    story.append(Paragraph(date_heure, ParagraphStyle(name='Date', fontSize=8, alignment=0)))
+    story.append(Paragraph(date_heure, st['Date']))
     story.append(Spacer(1, 0.3*cm))
     
     # Introduction
@@ -626,8 +2876,8 @@ def generate_carte_identification_complete(data, carte_id):
     - La partie basse peut être détachée et conservée avec vous.<br/>
     - La partie haute est indispensable pour effectuer toutes les modifications 
     souhaitées dans notre base de données I-CaD."""
-    story.append(Paragraph(intro_text, style_normal))
-    story.append(Spacer(1, 0.3*cm))
+    story.extend(static_block("carte_complete_intro", width,
+                              lambda: [Paragraph(intro_text, style_normal), Spacer(1, 0.3*cm)]))
     
     # Identifiant et mot de passe
     login_text = f"""Veuillez trouver ci-dessous l'identifiant et le mot de passe de votre animal. 
@@ -661,11 +2911,7 @@ def generate_carte_identification_complete(data, carte_id):
     
     if info_table_data:
         info_table = Table(info_table_data, colWidths=[5*cm, 11*cm])
-        info_table.setStyle(TableStyle([
-            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ('PADDING', (0,0), (-1,-1), 3),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ]))
+        info_table.setStyle(theme["tables"]['Grid'])
         story.append(info_table)
     
     story.append(Spacer(1, 0.3*cm))
@@ -688,11 +2934,7 @@ def generate_carte_identification_complete(data, carte_id):
         ])
     
     id_table = Table(id_table_data, colWidths=[2.5*cm, 13.5*cm])
-    id_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('PADDING', (0,0), (-1,-1), 3),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-    ]))
+    id_table.setStyle(theme["tables"]['Grid'])
     story.append(id_table)
     
     story.append(Spacer(1, 0.3*cm))
@@ -732,28 +2974,23 @@ def generate_carte_identification_complete(data, carte_id):
         ])
     
     desc_table = Table(desc_table_data, colWidths=[4*cm, 12*cm])
-    desc_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('PADDING', (0,0), (-1,-1), 3),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-    ]))
+    desc_table.setStyle(theme["tables"]['Grid'])
     story.append(desc_table)
     
-    # Ligne de séparation pointillée
-    story.append(Spacer(1, 0.5*cm))
-    story.append(HRFlowable(width="100%", thickness=1, color=colors.black, 
-                          dash=[3, 3], spaceAfter=0.5*cm, spaceBefore=0.5*cm))
-    
-    # ===== PARTIE BASSE =====
-    
-    # Titre partie basse
-    partie_basse_title = """PARTIE BASSE DE LA CARTE D'IDENTIFICATION À DÉTACHER ET À CONSERVER AVEC VOUS<br/>
-    [ne sert en aucun cas à effectuer de modifications dans notre fichier ou de changement de détenteur]"""
+    # Ligne de séparation pointillée et titre de la partie basse (fixes)
+    def separation():
+        partie_basse_title = """PARTIE BASSE DE LA CARTE D'IDENTIFICATION À DÉTACHER ET À CONSERVER AVEC VOUS<br/>
+        [ne sert en aucun cas à effectuer de modifications dans notre fichier ou de changement de détenteur]"""
+        return [
+            Spacer(1, 0.5*cm),
+            HRFlowable(width="100%", thickness=1, color=colors.black,
+                       dash=[3, 3], spaceAfter=0.5*cm, spaceBefore=0.5*cm),
+            # ===== PARTIE BASSE =====
+            Paragraph(partie_basse_title, st['PartieBasse']),
+            Spacer(1, 0.3*cm),
+        ]
     
-    story.append(Paragraph(partie_basse_title, 
-                         ParagraphStyle(name='PartieBasse', fontSize=8, alignment=1, 
-                                      fontName='Helvetica-Bold')))
-    story.append(Spacer(1, 0.3*cm))
+    story.extend(static_block("carte_complete_separation", width, separation))
     
     # Numéro réduit
     num_reduit = data.get('animalId', '250269612345678')
@@ -763,8 +3000,8 @@ def generate_carte_identification_complete(data, carte_id):
     # Informations partie basse
     info_basse_text = f"""
     <b>IDENTIFICATION : {data.get('animalId', '250269612345678')}</b><br/>
-    <b>NOM DU PROPRIETAIRE : {data.get('ownerName', 'Nom du propriétaire')}<br/><br/>
-    <b>ADRESSE DU PROPRIETAIRE : {data.get('ownerAddress', 'Adresse complète du propriétaire')}<br/><br/>
+    <b>NOM DU PROPRIETAIRE : {data.get('ownerName', 'Nom du propriétaire')}</b><br/><br/>
+    <b>ADRESSE DU PROPRIETAIRE : {data.get('ownerAddress', 'Adresse complète du propriétaire')}</b><br/><br/>
     <b>NOM : {data.get('animalName', 'FELIX').upper()}</b><br/>
     <b>NÉ(E) LE : {format_date(data.get('birthDate', ''))}</b><br/>
     <b>RACE : {data.get('breed', 'EUROPEEN').upper()}</b><br/>
@@ -773,9 +3010,8 @@ def generate_carte_identification_complete(data, carte_id):
     
     # Tableau pour la partie basse
     basse_data = [
-        [Paragraph(num_reduit, ParagraphStyle(name='NumReduit', fontSize=14, 
-                                            fontName='Helvetica-Bold', alignment=1)),
-         Paragraph(info_basse_text, ParagraphStyle(name='InfoBasse', fontSize=8))]
+        [Paragraph(num_reduit, st['NumReduit']),
+         Paragraph(info_basse_text, st['InfoBasse'])]
     ]
     
     basse_table = Table(basse_data, colWidths=[4*cm, 12*cm])
@@ -793,22 +3029,28 @@ def generate_carte_identification_complete(data, carte_id):
     
     try:
         doc.build(story)
-        print(f"✅ Carte identification complète générée: {pdf_path}")
-        return pdf_path
+        print(f"✅ Carte identification complète générée ({pdf_file.tell()} octets)")
+        pdf_file.seek(0)
+        return pdf_file
     except Exception as e:
         print(f"❌ Erreur génération carte: {e}")
-        error_doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+        pdf_file.seek(0)
+        pdf_file.truncate()
+        error_doc = SimpleDocTemplate(pdf_file, pagesize=A4)
         error_story = [Paragraph(f"Erreur: {str(e)}", style_normal)]
         error_doc.build(error_story)
-        return pdf_path
+        pdf_file.seek(0)
+        return pdf_file
 
+@measure_render("carte_haute")
+@needs_pdf_stack
 def generate_carte_identification_haute(data, carte_id):
     
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    pdf_path = temp_file.name
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
 
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=A4,
         leftMargin=1.2*cm,
         rightMargin=1.2*cm,
@@ -817,61 +3059,53 @@ def generate_carte_identification_haute(data, carte_id):
     )
 
     story = []
-    styles = getSampleStyleSheet()
+    theme = get_theme("carte")
+    st = theme["styles"]
 
     # ===== COULEURS I-CAD =====
-    BLUE_DARK = colors.HexColor("#2F4858")
-    BLUE_LIGHT = colors.HexColor("#F4F8FB")
-    BLUE_BORDER = colors.HexColor("#4A90E2")
+    BLUE_DARK = theme["colors"]["blue_dark"]
+    BLUE_LIGHT = theme["colors"]["blue_light"]
+    BLUE_BORDER = theme["colors"]["blue_border"]
 
-    # ===== EN-TÊTE =====
-    header = Table(
-        [[Paragraph(
-            """<font color="white"><b>SOCIÉTÉ D’IDENTIFICATION DES CARNIVORES DOMESTIQUES</b><br/>
-            112-114 Avenue Gabriel Péri – 94246 L’Haÿ-les-Roses Cedex<br/>
-            <b>0 810 778 778</b></font>""",
-            ParagraphStyle(
-                name="HeaderText",
-                alignment=1,
-                fontSize=9,
-                leading=12
-            )
-        )]],
-        colWidths=[17*cm],
-        rowHeights=[2.2*cm]
-    )
+    # ===== EN-TÊTE ET INTRO (fixes : mis en page une fois par worker) =====
+    def entete():
+        header = Table(
+            [[Paragraph(
+                """<font color="white"><b>SOCIÉTÉ D’IDENTIFICATION DES CARNIVORES DOMESTIQUES</b><br/>
+                112-114 Avenue Gabriel Péri – 94246 L’Haÿ-les-Roses Cedex<br/>
+                <b>0 810 778 778</b></font>""",
+                st['HeaderText']
+            )]],
+            colWidths=[17*cm],
+            rowHeights=[2.2*cm]
+        )
 
-    header.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), BLUE_DARK),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
-    story.append(header)
-    story.append(Spacer(1, 0.5*cm))
+        header.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,-1), BLUE_DARK),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ]))
 
-    # ===== INTRO =====
-    story.append(Paragraph(
-        "Madame, Monsieur,<br/><br/>"
-        "Nous avons le plaisir de vous adresser la carte d’identification de votre animal "
-        "suite à l’enregistrement de son identification et de vos coordonnées dans le "
-        "Fichier National des Carnivores Domestiques (chiens, chats, furets).",
-        ParagraphStyle(
-            name="Intro",
-            fontSize=8.5,
-            leading=12
-        )
-    ))
-    story.append(Spacer(1, 0.4*cm))
+        return [
+            header,
+            Spacer(1, 0.5*cm),
+            Paragraph(
+                "Madame, Monsieur,<br/><br/>"
+                "Nous avons le plaisir de vous adresser la carte d’identification de votre animal "
+                "suite à l’enregistrement de son identification et de vos coordonnées dans le "
+                "Fichier National des Carnivores Domestiques (chiens, chats, furets).",
+                st['Intro']
+            ),
+            Spacer(1, 0.4*cm),
+        ]
+
+    story.extend(static_block("carte_haute_entete", frame_width(doc), entete))
 
     # ===== BLOC IDENTIFIANT =====
     login = Table(
         [[Paragraph(
             f"<b>IDENTIFIANT :</b> {data.get('animalId','')}<br/>"
             f"<b>MOT DE PASSE :</b> {data.get('password','')}",
-            ParagraphStyle(
-                name="Login",
-                fontSize=9,
-                leading=14
-            )
+            st['HauteLogin']
         )]],
         colWidths=[17*cm]
     )
@@ -887,22 +3121,15 @@ def generate_carte_identification_haute(data, carte_id):
 
     # ===== FONCTION BLOC SECTION =====
     def section(title, rows):
-        bloc = [[Paragraph(f"<b>{title}</b>",
-                 ParagraphStyle(name="SectionTitle", fontSize=9))]]
+        bloc = [[Paragraph(f"<b>{title}</b>", st['SectionTitle'])]]
         for label, value in rows:
             bloc.append([
-                Paragraph(f"<b>{label}</b>", ParagraphStyle(name="Lbl", fontSize=8)),
-                Paragraph(value or "", ParagraphStyle(name="Val", fontSize=8))
+                Paragraph(f"<b>{label}</b>", st['Lbl']),
+                Paragraph(value or "", st['Val'])
             ])
 
         t = Table(bloc, colWidths=[6*cm, 11*cm], repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.whitesmoke),
-            ('BACKGROUND', (0,1), (-1,-1), BLUE_LIGHT),
-            ('LINEBEFORE', (0,0), (0,-1), 4, BLUE_BORDER),
-            ('GRID', (0,0), (-1,-1), 0.3, colors.lightgrey),
-            ('PADDING', (0,0), (-1,-1), 6),
-        ]))
+        t.setStyle(theme["tables"]['HauteSection'])
         return t
 
     # ===== DONNÉES =====
@@ -921,81 +3148,33 @@ def generate_carte_identification_haute(data, carte_id):
     ]))
     story.append(Spacer(1, 0.4*cm))
 
-    story.append(section("DESCRIPTION DE L’ANIMAL", [
-        ("Nom", data.get("animalName","")),
-        ("Date de naissance", format_date(data.get("birthDate",""))),
-        ("Race", data.get("breed","")),
-        ("Robe", data.get("coat","")),
-        ("Sexe", data.get("sex","")),
-        ("Stérilisé", data.get("sterilise","")),
-    ]))
-
-    # ===== FOOTER =====
-    story.append(Spacer(1, 0.8*cm))
-    story.append(Paragraph(
-        "Document généré automatiquement – Veterinary Pro",
-        ParagraphStyle(
-            name="Footer",
-            fontSize=7,
-            alignment=1,
-            textColor=colors.grey
-        )
-    ))
-
-    doc.build(story)
-    return pdf_path
-
-
-def generate_carte_identification_basse(data, carte_id):
-
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    pdf_path = temp_file.name
-
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        leftMargin=2*cm,
-        rightMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm
-    )
-
-    story = []
+    story.append(section("DESCRIPTION DE L’ANIMAL", [
+        ("Nom", data.get("animalName","")),
+        ("Date de naissance", format_date(data.get("birthDate",""))),
+        ("Race", data.get("breed","")),
+        ("Robe", data.get("coat","")),
+        ("Sexe", data.get("sex","")),
+        ("Stérilisé", data.get("sterilise","")),
+    ]))
 
-    # ===== TITRE =====
+    # ===== FOOTER =====
+    story.append(Spacer(1, 0.8*cm))
     story.append(Paragraph(
-        "PARTIE BASSE DE LA CARTE D'IDENTIFICATION À DÉTACHER<br/>ET À CONSERVER AVEC VOUS",
-        ParagraphStyle(
-            name="Titre",
-            fontName="Helvetica-Bold",
-            fontSize=12,
-            alignment=1,
-            textColor=colors.HexColor("#1F3A5F"),
-            leading=16,
-            spaceAfter=10
-        )
+        "Document généré automatiquement – Veterinary Pro",
+        st['HauteFooter']
     ))
 
-    # ===== SOUS TEXTE =====
-    story.append(Paragraph(
-        "[ne sert en aucun cas à effectuer de modifications dans notre fichier ou de<br/>changement de détenteur]",
-        ParagraphStyle(
-            name="SousTitre",
-            fontSize=9,
-            alignment=1,
-            textColor=colors.grey,
-            italic=True,
-            spaceAfter=16
-        )
-    ))
+    doc.build(story)
+    pdf_file.seek(0)
+    return pdf_file
 
-    # ===== LIGNE DE DÉCOUPE =====
-    decoupe = Table([[" "]], colWidths=[16*cm])
-    decoupe.setStyle(TableStyle([
-        ('LINEABOVE', (0,0), (-1,-1), 1, colors.HexColor("#B0BEC5"), None, (4,4)),
-    ]))
-    story.append(decoupe)
-    story.append(Spacer(1, 1*cm))
+
+# Dimensions (cm) de la carte de la partie basse, à détacher
+CARTE_BASSE_SIZE = (16, 4)
+
+def carte_basse_block(data, theme):
+    """Carte de la partie basse (numéro réduit + informations), partagée par la page seule et les planches"""
+    st = theme["styles"]
 
     # ===== NUMÉRO RÉDUIT =====
     full_id = data.get("animalId", "250269612345678")
@@ -1004,24 +3183,12 @@ def generate_carte_identification_basse(data, carte_id):
     bloc_num = Table(
         [[Paragraph(
             num_reduit,
-            ParagraphStyle(
-                name="Num",
-                fontName="Helvetica-Bold",
-                fontSize=20,
-                alignment=1,
-                textColor=colors.HexColor("#2E86DE")
-            )
+            st['Num']
         )]],
         colWidths=[4*cm],
         rowHeights=[3*cm]
     )
-
-    bloc_num.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), colors.HexColor("#EEF6FD")),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('BOX', (0,0), (-1,-1), 2, colors.white),
-        ('ROUNDEDCORNERS', [8, 8, 8, 8]),
-    ]))
+    bloc_num.setStyle(theme["tables"]['BasseNum'])
 
     # ===== INFOS DROITE =====
     infos = f"""
@@ -1034,65 +3201,89 @@ def generate_carte_identification_basse(data, carte_id):
     <b>COULEUR :</b> {data.get('coat', '').upper()}
     """
 
-    bloc_infos = Paragraph(
-        infos,
-        ParagraphStyle(
-            name="Infos",
-            fontSize=9.5,
-            leading=15,
-            textColor=colors.HexColor("#263238"),
-            alignment=2
-        )
-    )
+    bloc_infos = Paragraph(infos, st['Infos'])
 
-    # ===== CARTE PRINCIPALE =====
+    width, height = CARTE_BASSE_SIZE
     carte = Table(
         [[bloc_num, bloc_infos]],
-        colWidths=[5*cm, 11*cm],
-        rowHeights=[4*cm]
+        colWidths=[5*cm, (width - 5)*cm],
+        rowHeights=[height*cm]
     )
+    carte.setStyle(theme["tables"]['BasseCarte'])
+    return carte
 
-    carte.setStyle(TableStyle([
-        ('BOX', (0,0), (-1,-1), 1.2, colors.HexColor("#B0BEC5")),
-        ('BACKGROUND', (0,0), (-1,-1), colors.white),
-        ('LEFTPADDING', (0,0), (-1,-1), 16),
-        ('RIGHTPADDING', (0,0), (-1,-1), 16),
-        ('TOPPADDING', (0,0), (-4,-4), 18),
-        ('BOTTOMPADDING', (0,0), (-4,-4), 18),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('ROUNDEDCORNERS', [6, 6, 6, 6]),
-    ]))
+@measure_render("carte_basse")
+@needs_pdf_stack
+def generate_carte_identification_basse(data, carte_id):
+
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
+
+    doc = SimpleDocTemplate(
+        pdf_file,
+        pagesize=A4,
+        leftMargin=2*cm,
+        rightMargin=2*cm,
+        topMargin=2*cm,
+        bottomMargin=2*cm
+    )
+
+    story = []
+    theme = get_theme("carte")
+    st = theme["styles"]
+
+    # ===== TITRE, SOUS TEXTE ET LIGNE DE DÉCOUPE (fixes : mis en page une fois par worker) =====
+    def entete():
+        decoupe = Table([[" "]], colWidths=[16*cm])
+        decoupe.setStyle(TableStyle([
+            ('LINEABOVE', (0,0), (-1,-1), 1, colors.HexColor("#B0BEC5"), None, (4,4)),
+        ]))
+
+        return [
+            Paragraph(
+                "PARTIE BASSE DE LA CARTE D'IDENTIFICATION À DÉTACHER<br/>ET À CONSERVER AVEC VOUS",
+                st['Titre']
+            ),
+            Paragraph(
+                "[ne sert en aucun cas à effectuer de modifications dans notre fichier ou de<br/>changement de détenteur]",
+                st['SousTitre']
+            ),
+            decoupe,
+            Spacer(1, 1*cm),
+        ]
+
+    story.extend(static_block("carte_basse_entete", frame_width(doc), entete))
 
-    story.append(carte)
+    # ===== CARTE PRINCIPALE =====
+    story.append(carte_basse_block(data, theme))
 
     # ===== PIED DE PAGE =====
     story.append(Spacer(1, 1.2*cm))
     story.append(Paragraph(
         f"Carte générée le {datetime.now().strftime('%d/%m/%Y')} – Document informatif",
-        ParagraphStyle(
-            name="Footer",
-            fontSize=8,
-            alignment=1,
-            textColor=colors.grey
-        )
+        st['BasseFooter']
     ))
 
     doc.build(story)
-    return pdf_path
+    pdf_file.seek(0)
+    return pdf_file
 
 
 # ==================== FONCTIONS DE GÉNÉRATION PDF EXISTANTES ====================
 
+@measure_render("carnet")
+@needs_pdf_stack
 def generate_health_book_pdf(data, carnet_id):
     """Génère un carnet de santé professionnel et complet"""
     
-    # Créer un nom de fichier temporaire
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    pdf_path = temp_file.name
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
+    # Images intégrées (pour le suivi du cache des objets préparés)
+    images = []
     
     # Configuration du document
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=A4,
         topMargin=2*cm,
         bottomMargin=2*cm,
@@ -1102,103 +3293,22 @@ def generate_health_book_pdf(data, carnet_id):
     )
     
     story = []
-    styles = getSampleStyleSheet()
+    theme = get_theme("carnet")
+    st = theme["styles"]
     
     # ===== STYLES PERSONNALISÉS PROFESSIONNELS =====
     
     # Couleurs professionnelles
-    COLOR_PRIMARY = colors.HexColor('#2C3E50')      # Bleu foncé
-    COLOR_SECONDARY = colors.HexColor('#3498DB')    # Bleu
-    COLOR_ACCENT = colors.HexColor('#E74C3C')       # Rouge
-    COLOR_SUCCESS = colors.HexColor('#27AE60')      # Vert
-    COLOR_WARNING = colors.HexColor('#F39C12')      # Orange
-    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
-    
-    # Style titre principal
-    style_main_title = ParagraphStyle(
-        name='MainTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=COLOR_PRIMARY,
-        alignment=1,
-        spaceAfter=20,
-        spaceBefore=0,
-        fontName='Helvetica-Bold',
-        underlineWidth=1,
-        underlineColor=COLOR_SECONDARY
-    )
-    
-    # Style titre de section
-    style_section_title = ParagraphStyle(
-        name='SectionTitle',
-        parent=styles['Heading2'],
-        fontSize=18,
-        textColor=COLOR_PRIMARY,
-        alignment=0,
-        spaceAfter=15,
-        spaceBefore=25,
-        fontName='Helvetica-Bold',
-        borderPadding=8,
-        borderColor=COLOR_SECONDARY,
-        borderWidth=1,
-        borderRadius=5,
-        backColor=colors.HexColor('#E8F4F8')
-    )
-    
-    # Style sous-section
-    style_subsection = ParagraphStyle(
-        name='Subsection',
-        parent=styles['Heading3'],
-        fontSize=14,
-        textColor=COLOR_SECONDARY,
-        alignment=0,
-        spaceAfter=10,
-        spaceBefore=20,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Style texte normal
-    style_normal = ParagraphStyle(
-        name='Normal',
-        parent=styles['Normal'],
-        fontSize=11,
-        leading=14,
-        textColor=colors.black,
-        alignment=0
-    )
-    
-    # Style pour labels
-    style_label = ParagraphStyle(
-        name='Label',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=COLOR_PRIMARY,
-        fontName='Helvetica-Bold',
-        spaceAfter=3
-    )
-    
-    # Style pour valeurs
-    style_value = ParagraphStyle(
-        name='Value',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.black,
-        backColor=COLOR_LIGHT,
-        borderPadding=8,
-        borderColor=colors.HexColor('#EEEEEE'),
-        borderWidth=1,
-        borderRadius=3
-    )
+    COLOR_SECONDARY = theme["colors"]["secondary"]
+    COLOR_SUCCESS = theme["colors"]["success"]
     
-    # Style pour les tableaux d'en-tête
-    style_table_header = ParagraphStyle(
-        name='TableHeader',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.white,
-        alignment=1,
-        fontName='Helvetica-Bold'
-    )
+    style_main_title = st['MainTitle']
+    style_section_title = st['SectionTitle']
+    style_subsection = st['Subsection']
+    style_normal = st['Normal']
+    style_label = st['Label']
+    style_value = st['Value']
+    style_table_header = st['TableHeader']
     
     # ===== FONCTION POUR CRÉER DES SECTIONS =====
     def create_section(title, content, with_border=True):
@@ -1240,13 +3350,7 @@ def generate_health_book_pdf(data, carnet_id):
         ]]
         
         table = Table(data, colWidths=col_widths)
-        table.setStyle(TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (0,-1), 5),
-            ('RIGHTPADDING', (1,0), (1,-1), 5),
-            ('TOPPADDING', (0,0), (-1,-1), 6),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-        ]))
+        table.setStyle(theme["tables"]['InfoRow'])
         
         return table
     
@@ -1254,10 +3358,8 @@ def generate_health_book_pdf(data, carnet_id):
     
     # En-tête professionnel
     header_data = [
-        [Paragraph("CLINIQUE VÉTÉRINAIRE", 
-                  ParagraphStyle(name='HeaderLeft', fontSize=12, textColor=COLOR_PRIMARY, alignment=0)),
-         Paragraph("CARNET DE SANTÉ", 
-                  ParagraphStyle(name='HeaderRight', fontSize=12, textColor=COLOR_PRIMARY, alignment=2))]
+        [Paragraph("CLINIQUE VÉTÉRINAIRE", st['HeaderLeft']),
+         Paragraph("CARNET DE SANTÉ", st['HeaderRight'])]
     ]
     
     header_table = Table(header_data, colWidths=[10*cm, 6*cm])
@@ -1278,22 +3380,14 @@ def generate_health_book_pdf(data, carnet_id):
     
     # Nom de l'animal en évidence
     if data.get('name'):
-        style_animal_name = ParagraphStyle(
-            name='AnimalName',
-            parent=styles['Heading1'],
-            fontSize=28,
-            textColor=COLOR_ACCENT,
-            alignment=1,
-            spaceAfter=2*cm,
-            fontName='Helvetica-Bold'
-        )
-        story.append(Paragraph(data['name'].upper(), style_animal_name))
+        story.append(Paragraph(data['name'].upper(), st['AnimalName']))
     
     # Photo de l'animal
     if data.get('photo') and os.path.exists(data['photo']):
         try:
-            img = Image(data['photo'], width=10*cm, height=10*cm)
+            img = pdf_image(data['photo'], 10*cm, 10*cm)
             img.hAlign = 'CENTER'
+            images.append(img)
             
             # Cadre pour la photo
             photo_frame = Table([[img]], colWidths=[12*cm])
@@ -1324,11 +3418,8 @@ def generate_health_book_pdf(data, carnet_id):
         data_table = []
         for label, value in infos_principales:
             data_table.append([
-                Paragraph(f"<b>{label}</b>", 
-                         ParagraphStyle(name='InfoLabel', fontSize=12, textColor=colors.white, 
-                                      fontName='Helvetica-Bold', alignment=1)),
-                Paragraph(value, 
-                         ParagraphStyle(name='InfoValue', fontSize=12, textColor=colors.black, alignment=1))
+                Paragraph(f"<b>{label}</b>", st['InfoLabel']),
+                Paragraph(value, st['InfoValue'])
             ])
         
         table = Table(data_table, colWidths=[6*cm, 6*cm])
@@ -1347,14 +3438,14 @@ def generate_health_book_pdf(data, carnet_id):
     if data.get('proprietaire_nom'):
         story.append(Paragraph(
             f"<b>Propriétaire :</b> {data['proprietaire_nom']}",
-            ParagraphStyle(name='Proprio', fontSize=12, textColor=COLOR_PRIMARY, alignment=1)
+            st['Proprio']
         ))
     
     # Pied de page première page
     story.append(Spacer(1, 4*cm))
     story.append(Paragraph(
-        f"<i>Numéro de carnet : {carnet_id[:8]} • Créé le {datetime.now().strftime('%d/%m/%Y')}</i>",
-        ParagraphStyle(name='FooterInfo', fontSize=10, textColor=colors.grey, alignment=1)
+        f"<i>Numéro de carnet : {carnet_id[:8]} • Créé le {data.get('date_creation', datetime.now()).strftime('%d/%m/%Y')}</i>",
+        st['FooterInfo']
     ))
     
     story.append(PageBreak())
@@ -1541,98 +3632,79 @@ def generate_health_book_pdf(data, carnet_id):
     """
     
     story.append(Spacer(1, 2*cm))
-    story.append(Paragraph(
-        contact_info,
-        ParagraphStyle(
-            name='ContactInfo',
-            fontSize=11,
-            borderWidth=1,
-            borderColor=COLOR_SECONDARY,
-            borderPadding=15,
-            backColor=colors.HexColor('#F8F9FA')
-        )
-    ))
+    story.append(Paragraph(contact_info, st['ContactInfo']))
     
     # ===== PAGES DE CONSULTATIONS =====
-    for page_num in range(3):  # 3 pages de consultation
-        story.append(PageBreak())
-        
-        story.extend(create_section(
+    def consultation_page(page_num):
+        """Page vierge du journal des consultations (identique pour tous les carnets)"""
+        page = create_section(
             f"📝 JOURNAL DES CONSULTATIONS - Page {page_num + 1}",
             []
-        ))
+        )
         
         # Tableau pour les consultations
         consult_data = []
         headers = ["Date", "Motif", "Traitement", "Observations", "Vétérinaire", "Signature"]
         consult_data.append([
-            Paragraph(f"<b>{h}</b>", 
-                     ParagraphStyle(name='ConsultHeader', fontSize=9, alignment=1, 
-                                  fontName='Helvetica-Bold', textColor=colors.white)) 
+            Paragraph(f"<b>{h}</b>", st['ConsultHeader']) 
             for h in headers
         ])
         
         # 15 lignes par page
         for i in range(15):
-            consult_data.append([
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-                Paragraph("", ParagraphStyle(name='ConsultCell', fontSize=9)),
-            ])
+            consult_data.append([Paragraph("", st['ConsultCell']) for _ in headers])
         
         consult_table = Table(consult_data, colWidths=[2*cm, 3.5*cm, 3*cm, 3.5*cm, 2.5*cm, 2.5*cm])
-        consult_table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), COLOR_PRIMARY),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#EEEEEE')),
-            ('PADDING', (0,0), (-1,-1), 6),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('MINIMUMHEIGHT', (0,1), (-1,-1), 0.8*cm),
-        ]))
+        consult_table.setStyle(theme["tables"]['Consult'])
         
-        story.append(consult_table)
+        page.append(consult_table)
         
         # Instruction
-        story.append(Spacer(1, 1*cm))
-        story.append(Paragraph(
+        page.append(Spacer(1, 1*cm))
+        page.append(Paragraph(
             "<i>À compléter par le vétérinaire lors de chaque consultation. Conserver ce carnet avec vos documents importants.</i>",
-            ParagraphStyle(
-                name='Instruction',
-                fontSize=9,
-                textColor=colors.grey,
-                alignment=2
-            )
+            st['Instruction']
         ))
+        return page
+    
+    for page_num in range(3):  # 3 pages de consultation
+        story.append(PageBreak())
+        # Mise en page une seule fois par worker, puis rejouée telle quelle
+        story.extend(static_page(("carnet_consultations", page_num), doc,
+                                 lambda page_num=page_num: consultation_page(page_num)))
     
     # ===== CONSTRUCTION DU PDF =====
     try:
         doc.build(story)
-        print(f"✅ Carnet de santé généré avec succès : {pdf_path}")
-        return pdf_path
+        print(f"✅ Carnet de santé généré avec succès ({pdf_file.tell()} octets, {image_cache_note(images)})")
+        pdf_file.seek(0)
+        return pdf_file
     except Exception as e:
         print(f"❌ Erreur génération carnet: {e}")
         # PDF d'erreur
-        error_doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+        pdf_file.seek(0)
+        pdf_file.truncate()
+        error_doc = SimpleDocTemplate(pdf_file, pagesize=A4)
         error_story = [
             Paragraph("ERREUR DE GÉNÉRATION", style_main_title),
             Spacer(1, 2*cm),
             Paragraph(f"Erreur: {str(e)}", style_normal)
         ]
         error_doc.build(error_story)
-        return pdf_path
+        pdf_file.seek(0)
+        return pdf_file
 
+@measure_render("facture")
+@needs_pdf_stack
 def generate_facture_pdf(facture_data):
     """Génère un PDF professionnel pour la facture de livraison"""
     
-    # Créer un nom de fichier temporaire
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    pdf_path = temp_file.name
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
     
     # Configuration du document
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=A4,
         topMargin=1.5*cm,
         bottomMargin=1.5*cm,
@@ -1642,75 +3714,40 @@ def generate_facture_pdf(facture_data):
     )
     
     story = []
-    styles = getSampleStyleSheet()
+    theme = get_theme("facture")
+    st = theme["styles"]
     
     # Couleurs professionnelles
-    COLOR_PRIMARY = colors.HexColor('#198754')      # Vert
-    COLOR_SECONDARY = colors.HexColor('#2C3E50')    # Bleu foncé
-    COLOR_ACCENT = colors.HexColor('#FF6B6B')       # Rouge clair
-    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
+    COLOR_PRIMARY = theme["colors"]["primary"]
+    COLOR_LIGHT = theme["colors"]["light"]
     
     # Styles personnalisés
-    style_titre = ParagraphStyle(
-        name='TitrePrincipal',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=COLOR_PRIMARY,
-        alignment=1,
-        spaceAfter=5,
-        fontName='Helvetica-Bold'
-    )
-    
-    style_sous_titre = ParagraphStyle(
-        name='SousTitre',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=COLOR_SECONDARY,
-        alignment=1,
-        spaceAfter=20,
-        fontName='Helvetica-Bold'
-    )
-    
-    style_info = ParagraphStyle(
-        name='Info',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.grey,
-        alignment=0
-    )
-    
-    style_label = ParagraphStyle(
-        name='Label',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=COLOR_SECONDARY,
-        fontName='Helvetica-Bold',
-        spaceAfter=2
-    )
-    
-    style_value = ParagraphStyle(
-        name='Value',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.black
-    )
+    style_titre = st['TitrePrincipal']
+    style_value = st['Value']
     
     # ===== EN-TÊTE DE LA FACTURE =====
     
-    # Logo et informations entreprise
+    # Logo et informations entreprise : ne dépendent que de l'entreprise, mis en
+    # page une fois par worker et par entreprise (cellule de 10 cm moins ses marges de 6 pt)
+    entreprise = facture_data['entreprise']
+    entete_fields = ('nom', 'cp', 'ville', 'cp1', 'ville1', 'cp2', 'ville2', 'tel', 'email', 'tva')
     header_data = [
         [
-            Paragraph(f"<b>{facture_data['entreprise']['nom']}</b><br/>"
-                     f"{facture_data['entreprise']['cp']} {facture_data['entreprise']['ville']}<br/>"
-                     f"{facture_data['entreprise']['cp1']} {facture_data['entreprise']['ville1']}<br/>"
-                     f"{facture_data['entreprise']['cp2']} {facture_data['entreprise']['ville2']}<br/>"
-                     f"Tél: {facture_data['entreprise']['tel']} • Email: {facture_data['entreprise']['email']}<br/>"
-                     f"TVA: {facture_data['entreprise']['tva']}",
-                     ParagraphStyle(name='Entreprise', fontSize=10)),
+            static_block(
+                ("facture_entreprise",) + tuple(entreprise[field] for field in entete_fields),
+                10*cm - 12,
+                lambda: [Paragraph(f"<b>{entreprise['nom']}</b><br/>"
+                                   f"{entreprise['cp']} {entreprise['ville']}<br/>"
+                                   f"{entreprise['cp1']} {entreprise['ville1']}<br/>"
+                                   f"{entreprise['cp2']} {entreprise['ville2']}<br/>"
+                                   f"Tél: {entreprise['tel']} • Email: {entreprise['email']}<br/>"
+                                   f"TVA: {entreprise['tva']}",
+                                   st['Entreprise'])]
+            ),
             Paragraph(f"<b>FACTURE</b><br/>"
                      f"<font size='13'><b>{facture_data['numero_facture']}</b></font><br/>"
                      f"Date: {facture_data['date_creation'].strftime('%d/%m/%Y')}",
-                     ParagraphStyle(name='FactureInfo', fontSize=12, alignment=2))
+                     st['FactureInfo'])
         ]
     ]
     
@@ -1757,17 +3794,12 @@ def generate_facture_pdf(facture_data):
     
     if facture_data['livraison']['notes']:
         livraison_info.append(Spacer(1, 0.3*cm))
-        livraison_info.append(Paragraph(f"<b>Notes:</b> {facture_data['livraison']['notes']}", 
-                                       ParagraphStyle(name='Notes', fontSize=9, fontStyle='italic')))
+        livraison_info.append(Paragraph(f"<b>Notes:</b> {facture_data['livraison']['notes']}", st['Notes']))
     
     # Tableau deux colonnes alignées
     infos_table = Table([
-        [Paragraph("<b>INFORMATIONS DU CLIENT</b>", 
-                  ParagraphStyle(name='SectionHeader', fontSize=11, 
-                               fontName='Helvetica-Bold', alignment=0)),
-         Paragraph("<b>DÉTAILS DE LA LIVRAISON</b>", 
-                  ParagraphStyle(name='SectionHeader', fontSize=11, 
-                               fontName='Helvetica-Bold', alignment=0))],
+        [Paragraph("<b>INFORMATIONS DU CLIENT</b>", st['SectionHeader']),
+         Paragraph("<b>DÉTAILS DE LA LIVRAISON</b>", st['SectionHeader'])],
         [client_info, livraison_info]
     ], colWidths=[8*cm, 8*cm])
     
@@ -1784,9 +3816,7 @@ def generate_facture_pdf(facture_data):
     
     # ===== DÉTAILS DES ARTICLES =====
     
-    story.append(Paragraph("<b>DÉTAILS DES PRESTATIONS</b>", 
-                          ParagraphStyle(name='SectionTitre', fontSize=11, 
-                                        fontName='Helvetica-Bold', spaceAfter=10)))
+    story.append(Paragraph("<b>DÉTAILS DES PRESTATIONS</b>", st['SectionTitre']))
     
     # Tableau des articles
     articles_data = [["Description", "Qté", "Prix unitaire", "Total HT"]]
@@ -1794,9 +3824,9 @@ def generate_facture_pdf(facture_data):
     for item in facture_data['items']:
         articles_data.append([
             Paragraph(item['description'], style_value),
-            Paragraph(str(item['quantite']), ParagraphStyle(name='Center', fontSize=10, alignment=1)),
-            Paragraph(f"{item['prix']:.2f} €", ParagraphStyle(name='Right', fontSize=10, alignment=2)),
-            Paragraph(f"{item['total']:.2f} €", ParagraphStyle(name='Right', fontSize=10, alignment=2))
+            Paragraph(str(item['quantite']), st['Center']),
+            Paragraph(f"{item['prix']:.2f} €", st['Right']),
+            Paragraph(f"{item['total']:.2f} €", st['Right'])
         ])
     
     articles_table = Table(articles_data, colWidths=[9*cm, 2*cm, 3*cm, 2*cm])
@@ -1844,8 +3874,7 @@ def generate_facture_pdf(facture_data):
     <i>Facture émise le {facture_data['date_creation'].strftime('%d/%m/%Y à %H:%M')}</i>
     """
     
-    conditions_frame = Table([[Paragraph(conditions_content, 
-                                       ParagraphStyle(name='Conditions', fontSize=9))]], 
+    conditions_frame = Table([[Paragraph(conditions_content, st['Conditions'])]], 
                             colWidths=[16*cm])
     conditions_frame.setStyle(TableStyle([
         ('BOX', (0,0), (0,0), 0.5, COLOR_LIGHT),
@@ -1864,36 +3893,43 @@ def generate_facture_pdf(facture_data):
     Tél: {facture_data['entreprise']['tel']} • Email: {facture_data['entreprise']['email']}
     """
     
-    story.append(Paragraph(footer_content, 
-                          ParagraphStyle(name='Footer', fontSize=8, textColor=colors.grey, alignment=1)))
+    story.append(Paragraph(footer_content, st['Footer']))
     
     # ===== GÉNÉRATION =====
     
     try:
         doc.build(story)
-        print(f"✅ Facture générée: {pdf_path}")
-        return pdf_path
+        print(f"✅ Facture générée ({pdf_file.tell()} octets)")
+        pdf_file.seek(0)
+        return pdf_file
     except Exception as e:
         print(f"❌ Erreur génération facture: {e}")
         # PDF d'erreur
-        error_doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+        pdf_file.seek(0)
+        pdf_file.truncate()
+        error_doc = SimpleDocTemplate(pdf_file, pagesize=A4)
         error_story = [
             Paragraph("ERREUR DE GÉNÉRATION", style_titre),
             Spacer(1, 2*cm),
-            Paragraph(f"Erreur: {str(e)}", ParagraphStyle(name='Error', fontSize=10))
+            Paragraph(f"Erreur: {str(e)}", st['Error'])
         ]
         error_doc.build(error_story)
-        return pdf_path
+        pdf_file.seek(0)
+        return pdf_file
 
+@measure_render("attestation")
+@needs_pdf_stack
 def generate_attestation_pdf(data, attestation_id):
     """Génère un PDF professionnel pour l'attestation vétérinaire"""
     
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    pdf_path = temp_file.name
+    # Tampon de rendu (mémoire, ou disque au-delà du seuil configuré)
+    pdf_file = new_pdf_buffer()
+    # Images intégrées (pour le suivi du cache des objets préparés)
+    images = []
     
     # Configuration du document
     doc = SimpleDocTemplate(
-        pdf_path,
+        pdf_file,
         pagesize=A4,
         topMargin=1*cm,
         bottomMargin=1*cm,
@@ -1903,108 +3939,55 @@ def generate_attestation_pdf(data, attestation_id):
     )
     
     story = []
-    styles = getSampleStyleSheet()
+    theme = get_theme("attestation")
+    st = theme["styles"]
     
     # Couleurs professionnelles
-    COLOR_PRIMARY = colors.HexColor('#2C3E50')      # Bleu foncé
-    COLOR_SECONDARY = colors.HexColor('#3498DB')    # Bleu
-    COLOR_ACCENT = colors.HexColor('#E74C3C')       # Rouge
-    COLOR_SUCCESS = colors.HexColor('#27AE60')      # Vert
-    COLOR_LIGHT = colors.HexColor('#F8F9FA')        # Gris clair
+    COLOR_SECONDARY = theme["colors"]["secondary"]
     
     # Styles personnalisés
-    style_main_title = ParagraphStyle(
-        name='MainTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=COLOR_PRIMARY,
-        alignment=1,
-        spaceAfter=18,
-        spaceBefore=0,
-        fontName='Helvetica-Bold',
-        underlineWidth=1,
-        underlineColor=COLOR_SECONDARY
-    )
-    
-    style_header = ParagraphStyle(
-        name='Header',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=COLOR_PRIMARY,
-        alignment=1,
-        spaceAfter=10,
-        spaceBefore=15,
-        fontName='Helvetica-Bold',
-        borderPadding=5,
-        borderColor=COLOR_PRIMARY,
-        borderWidth=0,
-        leftIndent=0
-    )
-    
-    style_normal = ParagraphStyle(
-        name='Normal',
-        parent=styles['Normal'],
-        fontSize=10,
-        leading=15,
-        textColor=colors.black,
-        alignment=4,
-        
-    )
-    
-    style_label = ParagraphStyle(
-        name='Label',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=COLOR_PRIMARY,
-        fontName='Helvetica-Bold',
-        spaceAfter=3
-    )
-    
-    style_value = ParagraphStyle(
-        name='Value',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.black,
-        backColor=COLOR_LIGHT,
-        borderPadding=8,
-        borderColor=colors.HexColor('#EEEEEE'),
-        borderWidth=1,
-        borderRadius=3
-    )
-    
-    # ===== EN-TÊTE PROFESSIONNEL =====
-    
-    # En-tête avec cadre
-    header_content = f"""
-    <b>CABINET VÉTÉRINAIRE</b><br/>
-    Dr. {data.get('vet_fullname', '[Nom du vétérinaire]')} • Adresse : {data.get('vet_address', '[Adresse complète]')}<br/>
-    Téléphone: {data.get('vet_phone', '[Numéro]')} • Email: {data.get('vet_email', '[Adresse email]')}
-    """
-    
-    header_frame = Table([[Paragraph(header_content, 
-                                   ParagraphStyle(name='CabinetInfo', fontSize=10, alignment=1, textColor=COLOR_PRIMARY))]], 
-                        colWidths=[16*cm])
-    header_frame.setStyle(TableStyle([
-        ('BOX', (0,0), (0,0), 0.5, COLOR_SECONDARY),
-        ('BACKGROUND', (0,0), (0,0), colors.HexColor('#F0F8FF')),
-        ('PADDING', (0,0), (0,0), 8),
-        ('ROUNDEDCORNERS', [6, 6, 6, 6]),
-    ]))
-    
-    story.append(header_frame)
-    story.append(Spacer(1, 0.5*cm))
-    
-    # Ligne de séparation décorative
-    line = HRFlowable(width="100%", thickness=1, color=COLOR_SECONDARY, 
-                     spaceAfter=5, spaceBefore=5,
-                     lineCap='round', dash=None)
-    story.append(line)
-    story.append(Spacer(1, 0.3*cm))
-    
-    # ===== TITRE PRINCIPAL =====
-    
-    story.append(Paragraph("ATTESTATION VÉTÉRINAIRE", style_main_title))
-    story.append(Spacer(1, 0.1*cm))
+    style_main_title = st['MainTitle']
+    style_normal = st['Normal']
+    style_label = st['Label']
+    style_value = st['Value']
+    
+    # ===== EN-TÊTE PROFESSIONNEL ET TITRE =====
+    # Ne dépendent que du cabinet : mis en page une fois par worker et par cabinet
+    cabinet = (data.get('vet_fullname', '[Nom du vétérinaire]'), data.get('vet_address', '[Adresse complète]'),
+               data.get('vet_phone', '[Numéro]'), data.get('vet_email', '[Adresse email]'))
+
+    def entete():
+        # En-tête avec cadre
+        header_content = f"""
+        <b>CABINET VÉTÉRINAIRE</b><br/>
+        Dr. {cabinet[0]} • Adresse : {cabinet[1]}<br/>
+        Téléphone: {cabinet[2]} • Email: {cabinet[3]}
+        """
+
+        header_frame = Table([[Paragraph(header_content, st['CabinetInfo'])]],
+                            colWidths=[16*cm])
+        header_frame.setStyle(TableStyle([
+            ('BOX', (0,0), (0,0), 0.5, COLOR_SECONDARY),
+            ('BACKGROUND', (0,0), (0,0), colors.HexColor('#F0F8FF')),
+            ('PADDING', (0,0), (0,0), 8),
+            ('ROUNDEDCORNERS', [6, 6, 6, 6]),
+        ]))
+
+        # Ligne de séparation décorative
+        line = HRFlowable(width="100%", thickness=1, color=COLOR_SECONDARY,
+                         spaceAfter=5, spaceBefore=5,
+                         lineCap='round', dash=None)
+
+        return [
+            header_frame,
+            Spacer(1, 0.5*cm),
+            line,
+            Spacer(1, 0.3*cm),
+            Paragraph("ATTESTATION VÉTÉRINAIRE", style_main_title),
+            Spacer(1, 0.1*cm),
+        ]
+
+    story.extend(static_block(("attestation_entete",) + cabinet, frame_width(doc), entete))
     
     # ===== INTRODUCTION =====
     
@@ -2059,9 +4042,7 @@ def generate_attestation_pdf(data, attestation_id):
     
     # ===== RÉSULTATS DE L'EXAMEN =====
     
-    story.append(Paragraph("RÉSULTATS DE L'EXAMEN CLINIQUE :", 
-                          ParagraphStyle(name='ExamTitle', parent=styles['Heading3'], 
-                                       fontSize=13, textColor=COLOR_PRIMARY)))
+    story.append(Paragraph("RÉSULTATS DE L'EXAMEN CLINIQUE :", st['ExamTitle']))
     story.append(Spacer(1, 0.5*cm))
     
     # Liste des attestations avec icônes
@@ -2074,13 +4055,9 @@ def generate_attestation_pdf(data, attestation_id):
     
     for text, checked in attestations:
         if checked:
-            story.append(Paragraph(f"✓ {text}", 
-                                 ParagraphStyle(name='Checked', parent=style_normal, 
-                                              textColor=COLOR_SUCCESS)))
+            story.append(Paragraph(f"✓ {text}", st['Checked']))
         else:
-            story.append(Paragraph(f"✗ {text}", 
-                                 ParagraphStyle(name='Unchecked', parent=style_normal, 
-                                              textColor=colors.grey)))
+            story.append(Paragraph(f"✗ {text}", st['Unchecked']))
     
     story.append(Spacer(1, 0.7*cm))
     
@@ -2088,7 +4065,7 @@ def generate_attestation_pdf(data, attestation_id):
     
     story.append(Paragraph(
         "La présente attestation est établie pour servir et valoir ce que de droit.",
-        ParagraphStyle(name='FinalText', fontSize=10, alignment=1, fontStyle='italic')
+        st['FinalText']
     ))
     
     story.append(Spacer(1, 0.3*cm))
@@ -2100,11 +4077,10 @@ def generate_attestation_pdf(data, attestation_id):
         [   
             # Colonne gauche : Date
             Paragraph(f"<b>Fait à {data.get('city', '[Ville]')}, le {format_date(data.get('date', datetime.now().strftime('%Y-%m-%d')))}</b>", 
-                     ParagraphStyle(name='DateCol', fontSize=10, alignment=0)),
+                     st['DateCol']),
             
             # Colonne droite : Signature
-            Paragraph("Signature du vétérinaire ", 
-                     ParagraphStyle(name='SignatureLabel', fontSize=10, alignment=2))
+            Paragraph("Signature du vétérinaire ", st['SignatureLabel'])
         ]
     ]
     
@@ -2120,8 +4096,9 @@ def generate_attestation_pdf(data, attestation_id):
     # Signature numérique si disponible
     if data.get('signature_path') and os.path.exists(data['signature_path']):
         try:
-            img_signature = Image(data['signature_path'], width=6*cm, height=2.5*cm)
+            img_signature = pdf_image(data['signature_path'], 6*cm, 2.5*cm)
             img_signature.hAlign = 'RIGHT'
+            images.append(img_signature)
             story.append(img_signature)
         except Exception as e:
             print(f"Erreur signature image: {e}")
@@ -2130,8 +4107,9 @@ def generate_attestation_pdf(data, attestation_id):
     if data.get('stamp_image') and os.path.exists(data['stamp_image']):
         try:
             story.append(Spacer(1, 0.1*cm))
-            img_cachet = Image(data['stamp_image'], width=3*cm, height=3*cm)
+            img_cachet = pdf_image(data['stamp_image'], 3*cm, 3*cm)
             img_cachet.hAlign = 'CENTER'
+            images.append(img_cachet)
             cachet_table = Table([[img_cachet]], colWidths=[10*cm])
             cachet_table.setStyle(TableStyle([
                 ('ALIGN', (0,0), (0,0), 'CENTER'),
@@ -2153,26 +4131,427 @@ def generate_attestation_pdf(data, attestation_id):
     Établi le {datetime.now().strftime('%d/%m/%Y à %H:%M')} • ID: {attestation_id[:8]}</i>
     """
     
-    story.append(Paragraph(footer_text, 
-                          ParagraphStyle(name='Footer', fontSize=6, textColor=colors.grey, alignment=1)))
+    story.append(Paragraph(footer_text, st['Footer']))
     
     # ===== GÉNÉRATION DU PDF =====
     
     try:
         doc.build(story)
-        print(f"✅ Attestation PDF générée: {pdf_path}")
-        return pdf_path
+        print(f"✅ Attestation PDF générée ({pdf_file.tell()} octets, {image_cache_note(images)})")
+        pdf_file.seek(0)
+        return pdf_file
     except Exception as e:
         print(f"❌ Erreur génération attestation: {e}")
-        error_doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+        pdf_file.seek(0)
+        pdf_file.truncate()
+        error_doc = SimpleDocTemplate(pdf_file, pagesize=A4)
         error_story = [
             Paragraph("ERREUR DE GÉNÉRATION", style_main_title),
             Spacer(1, 2*cm),
             Paragraph(f"Erreur: {str(e)}", style_normal)
         ]
         error_doc.build(error_story)
-        return pdf_path
+        pdf_file.seek(0)
+        return pdf_file
         
+# Générateurs adressables par nom (tâches asynchrones)
+PDF_GENERATORS = {
+    "carnet": generate_health_book_pdf,
+    "facture": generate_facture_pdf,
+    "attestation": generate_attestation_pdf,
+    "carte_complete": generate_carte_identification_complete,
+    "carte_haute": generate_carte_identification_haute,
+    "carte_basse": generate_carte_identification_basse,
+}
+
+# ==================== RENDU GROUPÉ DES CARTES D'IDENTIFICATION ====================
+
+CARTE_PARTIES = ("complete", "haute", "basse")
+
+def carte_parties(values):
+    """Parties demandées (champ partie répété ou "haute,basse"), dans l'ordre, sans doublon ; complète par défaut"""
+    parties = []
+    for value in values:
+        for partie in value.split(","):
+            partie = partie.strip()
+            if partie in CARTE_PARTIES and partie not in parties:
+                parties.append(partie)
+    return parties or ["complete"]
+
+def carte_filename(partie, data):
+    """Nom du fichier PDF d'une partie de la carte"""
+    return f"Carte_Identification_{partie.capitalize()}_{data['animalName'].replace(' ', '_')}.pdf"
+
+@needs_pdf_stack
+def generate_cartes_identification(data, carte_id, parties=CARTE_PARTIES):
+    """Rend plusieurs parties de la carte en un seul passage, dans une archive ZIP.
+
+    Les données ne sont lues et enregistrées qu'une fois ; les blocs fixes des
+    trois parties (en-têtes, introductions, lignes de découpe) sont mis en page
+    une fois par worker (voir static_block), seules les données de l'animal le
+    sont à chaque partie.
+    """
+    archive_file = new_pdf_buffer()
+    # Les PDF sont déjà compressés : on les stocke tels quels
+    with zipfile.ZipFile(archive_file, "w", compression=zipfile.ZIP_STORED) as archive:
+        for partie in parties:
+            pdf_file = PDF_GENERATORS[f"carte_{partie}"](data, carte_id)
+            with archive.open(carte_filename(partie, data), "w") as entry:
+                shutil.copyfileobj(pdf_file, entry)
+            pdf_file.close()
+    print(f"✅ Cartes identification générées : {', '.join(parties)} ({archive_file.tell()} octets)")
+    archive_file.seek(0)
+    return archive_file
+
+# ==================== PLANCHES D'IMPRESSION DES PARTIES BASSES ====================
+
+# Champs des cartes utilisés par la partie basse
+CARTE_BASSE_PROJECTION = {"animalId": 1, "animalName": 1, "ownerName": 1, "birthDate": 1, "breed": 1, "coat": 1}
+
+# Marges de la planche, espace entre deux cartes, longueur et retrait des traits de coupe (cm)
+PLANCHE_MARGE = 1
+PLANCHE_GOUTTIERE = 0.6
+PLANCHE_REPERE = 0.2
+PLANCHE_REPERE_RETRAIT = 0.05
+
+def cartes_planche_query(params):
+    """Filtre MongoDB des cartes d'une planche : ?ids=a,b,c, ?identification=, ?depuis=, ?jusqu="""
+    query = {}
+    if params.get("ids"):
+        ids = [value.strip() for value in params["ids"].split(",") if value.strip()]
+        if not all(ObjectId.is_valid(value) for value in ids):
+            raise ValueError("Identifiants de cartes invalides")
+        query["_id"] = {"$in": [ObjectId(value) for value in ids]}
+    if params.get("identification"):
+        query["animalId"] = params["identification"]
+    periode = date_creation_range(params)
+    if periode:
+        query["date_creation"] = periode
+    if not query:
+        raise ValueError("Aucune carte sélectionnée (ids, identification, depuis ou jusqu)")
+    return query
+
+@measure_render("cartes_planche")
+@needs_pdf_stack
+def generate_planche_parties_basses(cartes):
+    """Impose les parties basses de plusieurs cartes sur des planches A4, avec traits de coupe.
+
+    Les cartes sont empilées une par emplacement de la grille de la page ; le
+    thème est partagé par toutes les cartes et les traits de coupe et le pied
+    de page sont dessinés une seule fois par planche (un seul tracé).
+    """
+    pdf_file = new_pdf_buffer()
+    theme = get_theme("carte")
+    page_width, page_height = A4
+    width, height = (size * cm for size in CARTE_BASSE_SIZE)
+    marge, gouttiere = PLANCHE_MARGE * cm, PLANCHE_GOUTTIERE * cm
+    repere, retrait = PLANCHE_REPERE * cm, PLANCHE_REPERE_RETRAIT * cm
+
+    # Emplacements de haut en bas : Platypus passe au suivant quand une carte ne tient plus
+    per_page = int((page_height - 2 * marge + gouttiere) // (height + gouttiere))
+    x = (page_width - width) / 2
+    slots = [(x, page_height - marge - height - row * (height + gouttiere)) for row in range(per_page)]
+    pages = -(-len(cartes) // per_page)
+    date = datetime.now().strftime('%d/%m/%Y')
+
+    def traits_de_coupe(canv, doc):
+        page = canv.getPageNumber()
+        filled = slots[:len(cartes) - (page - 1) * per_page]
+        canv.saveState()
+        canv.setLineWidth(0.3)
+        canv.setStrokeColor(colors.black)
+        path = canv.beginPath()
+        for left, bottom in filled:
+            for cx, dx in ((left, -1), (left + width, 1)):
+                for cy, dy in ((bottom, -1), (bottom + height, 1)):
+                    path.moveTo(cx + dx * retrait, cy)
+                    path.lineTo(cx + dx * (retrait + repere), cy)
+                    path.moveTo(cx, cy + dy * retrait)
+                    path.lineTo(cx, cy + dy * (retrait + repere))
+        canv.drawPath(path, stroke=1, fill=0)
+        canv.setFont("Helvetica", 7)
+        canv.setFillColor(colors.grey)
+        canv.drawCentredString(page_width / 2, marge / 2,
+                               f"Parties basses des cartes d'identification – planche {page}/{pages} – {date}")
+        canv.restoreState()
+
+    frames = [Frame(left, bottom, width, height, leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0,
+                    id=f"carte{row}") for row, (left, bottom) in enumerate(slots)]
+    doc = BaseDocTemplate(pdf_file, pagesize=A4, title="Planche des parties basses",
+                          pageTemplates=[PageTemplate(id="planche", frames=frames, onPage=traits_de_coupe)])
+    doc.build([carte_basse_block(carte, theme) for carte in cartes])
+    print(f"✅ Planche de {len(cartes)} parties basses générée ({pages} page(s), {pdf_file.tell()} octets)")
+    pdf_file.seek(0)
+    return pdf_file
+
+@app.route("/cartes/planche")
+def planche_cartes():
+    """Planche A4 des parties basses des cartes sélectionnées (?ids=a,b,c, ?identification=, ?depuis=, ?jusqu=)"""
+    try:
+        query = cartes_planche_query(request.args)
+    except ValueError as e:
+        return f"Sélection invalide : {e}", 400
+    limit = app.config["PLANCHE_MAX_CARTES"]
+    cartes = list(db.cartes_identification.find(query, CARTE_BASSE_PROJECTION)
+                  .sort([("date_creation", ASCENDING), ("_id", ASCENDING)]).limit(limit + 1))
+    phase_done("db")
+    if not cartes:
+        return "Aucune carte ne correspond à la sélection", 404
+    if len(cartes) > limit:
+        return f"Trop de cartes sélectionnées (maximum {limit}) : affinez la sélection", 400
+    pdf_file = generate_planche_parties_basses(cartes)
+    phase_done("render")
+    nom_fichier = f"Planche_Parties_Basses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    response = send_pdf(pdf_file, nom_fichier)
+    phase_done("response")
+    return response
+
+# ==================== BANC D'ESSAI DES GÉNÉRATEURS PDF ====================
+
+def _bench_images(folder):
+    """Photo, cachet et signature synthétiques, enregistrés comme le ferait /save"""
+    rng = random.Random(0)
+    photo = PILImage.new("RGB", (2400, 1800), (120, 150, 90))
+    stamp = PILImage.new("RGBA", (800, 800), (0, 0, 0, 0))
+    signature = PILImage.new("RGBA", (900, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(photo)
+    for _ in range(400):
+        x, y = rng.randrange(2400), rng.randrange(1800)
+        draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    ImageDraw.Draw(stamp).ellipse((40, 40, 760, 760), outline=(20, 40, 160, 255), width=30)
+    draw = ImageDraw.Draw(signature)
+    draw.line([(rng.randrange(900), rng.randrange(300)) for _ in range(60)], fill=(0, 0, 0, 255), width=4)
+    paths = {}
+    for kind, img in (("photo", photo), ("cachet", stamp)):
+        raw = io.BytesIO()
+        img.save(raw, format="JPEG" if kind == "photo" else "PNG")
+        raw.seek(0)
+        paths[kind] = ingest_image(raw, kind, folder)
+    raw = io.BytesIO()
+    signature.save(raw, format="PNG")
+    paths["signature"] = store_upload(raw.getvalue(), "signature", "png", folder)
+    return paths
+
+def bench_payloads(sizes, images):
+    """Cas du banc d'essai : (générateur, taille, arguments), avec des données de la forme de celles des routes.
+
+    La taille est le nombre de vaccins et d'antiparasitaires (carnet) ou
+    d'articles (facture) ; les images ne sont jointes que pour une taille > 0.
+    L'attestation ne dépend que de la présence des images et les cartes
+    d'aucune taille : elles sont mesurées une fois par cas distinct.
+    """
+    now = datetime.now()
+    carte = {"ownerName": "Marie Dupont", "ownerAddress": "12 rue des Lilas 69003 Lyon", "email": "marie@example.com",
+             "password": "", "animalId": "250269612345678", "animalName": "Filou", "animalEspece": "CHAT",
+             "birthDate": "2020-04-12", "idDate": "2020-07-01", "idLocation": "Cou gauche", "breed": "Européen",
+             "coat": "Tigré", "hairType": "COURT", "sex": "MALE", "sterilise": "OUI", "paysOrigine": "FRANCE",
+             "veterinaireNom": "Dr Martin", "veterinaireContact": "04 78 00 00 00", "date_creation": now,
+             "numero_carte": "CART-BENCH-0001"}
+    attestation_done = set()
+    for size in sizes:
+        files = images if size else {}
+        carnet = {"name": "Rex", "species": "Chien", "breed": "Labrador", "age": "5 ans", "sex": "Mâle",
+                  "sterilise": "Oui", "poids": "32 kg", "identification": "250269600000001",
+                  "allergies": "Aucune", "antecedents": "Fracture patte avant (2021)", "traitement": "Aucun",
+                  "attestation_date": "2024-03-01", "attestation_veterinaire": "Dr Martin",
+                  "attestation_ordre": "12345", "attestation_validite": "1 an", "attestation_observations": "RAS",
+                  "proprietaire_nom": "Marie Dupont", "proprietaire_tel": "06 00 00 00 00",
+                  "proprietaire_email": "marie@example.com", "proprietaire_adresse": "12 rue des Lilas",
+                  "proprietaire_ville": "Lyon", "proprietaire_cp": "69003", "veterinaire_cabinet": "Clinique du Parc",
+                  "veterinaire_tel": "04 78 00 00 00", "veterinaire_adresse": "1 place Bellecour",
+                  "veterinaire_email": "clinique@example.com",
+                  "vaccins": [{"type": f"Vaccin {i}", "date": "2024-01-15", "rappel": "2025-01-15", "lot": f"L{i:05d}"}
+                              for i in range(size)],
+                  "antiparasitaires": [{"type": "Vermifuge", "date": "2024-02-01", "produit": f"Produit {i}",
+                                        "prochaine_date": "2024-05-01"} for i in range(size)],
+                  "photo": files.get("photo"), "cachet": files.get("cachet"), "signature": files.get("signature"),
+                  "date_creation": now}
+        yield "carnet", size, (carnet, "0123456789abcdef01234567")
+
+        items = [{"description": f"Transport animalier, trajet {i}", "quantite": 1.0 + i % 3, "prix": 45.0,
+                  "total": (1.0 + i % 3) * 45.0} for i in range(size)]
+        sous_total = sum(item["total"] for item in items)
+        facture = {"carnet_id": None, "entreprise": dict.fromkeys(
+                       ["nom", "siret", "tva", "adresse", "cp", "ville", "cp1", "ville1", "cp2", "ville2", "tel", "email"],
+                       "Transports Animaliers du Rhône"),
+                   "client": dict.fromkeys(["nom", "tel", "email", "adresse", "cp", "ville"], "Marie Dupont"),
+                   "livraison": dict.fromkeys(["date", "heure_prise", "heure_livraison", "espece", "race", "notes"], "2024-03-01"),
+                   "paiement": {"conditions": "30 jours", "mentions": "TVA non applicable"},
+                   "items": items, "totaux": {"sous_total": sous_total, "tva": sous_total * 0.2, "total_ttc": sous_total * 1.2},
+                   "date_creation": now, "numero_facture": "FAC-BENCH-0001", "_id": "0123456789abcdef01234567"}
+        yield "facture", size, (facture,)
+
+        if bool(files) not in attestation_done:
+            attestation_done.add(bool(files))
+            attestation = {"vet_fullname": "Dr Martin", "vet_registration": "12345", "vet_address": "1 place Bellecour",
+                           "vet_phone": "04 78 00 00 00", "vet_email": "clinique@example.com", "animal_name": "Rex",
+                           "animal_species": "Chien", "animal_breed": "Labrador", "animal_gender": "Mâle",
+                           "animal_couleur": "Sable", "animal_puce": "250269600000001", "animal_id": "", "owner_name": "Marie Dupont",
+                           "owner_address": "", "owner_phone": "", "owner_email": "", "attestation_health": True,
+                           "attestation_vaccination": True, "attestation_disease": False, "attestation_transport": True,
+                           "date": "2024-03-01", "city": "Lyon", "validity_date": "", "observations": "",
+                           "numero_attestation": "ATT-BENCH-0001", "stamp_image": files.get("cachet"),
+                           "signature_path": files.get("signature"), "date_creation": now}
+            yield "attestation", size, (attestation, "0123456789abcdef01234567")
+
+        if size == sizes[0]:
+            for partie in ("complete", "haute", "basse"):
+                yield f"carte_{partie}", size, (carte, "0123456789abcdef01234567")
+
+def _reset_render_caches():
+    """Vide les caches de rendu du worker (mesure à froid)"""
+    global _pdf_images_size
+    with _pdf_images_lock:
+        _pdf_images.clear()
+        _pdf_images_size = 0
+    _variants.clear()
+    shutil.rmtree(app.config["PDF_VARIANT_FOLDER"], ignore_errors=True)
+    with _static_blocks_lock:
+        _static_blocks.clear()
+
+def bench_generator(generator, args, repeat, cold=False):
+    """Mesure un générateur : temps médian (s), pic mémoire Python (octets), taille du PDF (octets)"""
+    import statistics
+    import tracemalloc
+    from contextlib import redirect_stdout
+
+    def render():
+        if cold:
+            _reset_render_caches()
+        with redirect_stdout(io.StringIO()):
+            pdf_file = PDF_GENERATORS[generator](*copy.deepcopy(args))
+        size = pdf_file.seek(0, io.SEEK_END)
+        pdf_file.close()
+        return size
+
+    size = render()  # premier rendu : chargement de ReportLab, styles et caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        render()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(timings), "peak_bytes": peak, "pdf_bytes": size}
+
+@app.cli.command("bench-pdf")
+@click.option("--sizes", default="0,10,200", show_default=True, help="Nombres de lignes (vaccins, articles) à mesurer")
+@click.option("--repeat", default=5, show_default=True, help="Rendus mesurés par cas (médiane)")
+@click.option("--only", multiple=True, type=click.Choice(sorted(PDF_GENERATORS)), help="Limiter à certains générateurs")
+@click.option("--cold", is_flag=True, help="Vider les caches d'images avant chaque rendu")
+@click.option("--save", "save_path", type=click.Path(dir_okay=False), help="Enregistrer les résultats comme référence (JSON)")
+@click.option("--compare", "compare_path", type=click.Path(exists=True, dir_okay=False), help="Comparer à une référence enregistrée")
+@click.option("--tolerance", default=0.2, show_default=True, help="Écart relatif au-delà duquel un cas est signalé")
+def bench_pdf_command(sizes, repeat, only, cold, save_path, compare_path, tolerance):
+    """Mesure chaque générateur PDF sur des données synthétiques, sans MongoDB.
+
+    Affiche le temps médian, le pic de mémoire Python (tracemalloc) et la taille
+    du PDF par générateur et par taille. Avec --compare, les cas plus lents,
+    plus gourmands ou plus gros que la référence au-delà de --tolerance sont
+    signalés et la commande se termine en erreur.
+    """
+    load_pdf_stack()
+    sizes = sorted({int(size) for size in sizes.split(",")})
+    baseline = {}
+    if compare_path:
+        with open(compare_path) as f:
+            baseline = {(case["generator"], case["size"]): case for case in json.load(f)["results"]}
+
+    results, regressions = [], 0
+    with tempfile.TemporaryDirectory() as folder:
+        app.config["PDF_VARIANT_FOLDER"] = os.path.join(folder, "variantes")
+        images = _bench_images(folder)
+        click.echo(f"{'générateur':<16}{'taille':>7}{'temps ms':>11}{'pic Mo':>9}{'PDF Ko':>9}")
+        for generator, size, args in bench_payloads(sizes, images):
+            if only and generator not in only:
+                continue
+            try:
+                measure = bench_generator(generator, args, repeat, cold)
+            except Exception as e:
+                click.echo(f"{generator:<16}{size:>7}  ❌ {str(e).splitlines()[-1][:80]}")
+                continue
+            results.append({"generator": generator, "size": size, **measure})
+            line = (f"{generator:<16}{size:>7}{measure['seconds'] * 1000:>11.1f}"
+                    f"{measure['peak_bytes'] / 1024 / 1024:>9.1f}{measure['pdf_bytes'] / 1024:>9.1f}")
+            reference = baseline.get((generator, size))
+            if reference:
+                changes = {key: measure[key] / reference[key] - 1
+                           for key in ("seconds", "peak_bytes", "pdf_bytes") if reference[key]}
+                labels = {"seconds": "temps", "peak_bytes": "mémoire", "pdf_bytes": "taille"}
+                line += "  " + " ".join(f"{labels[key]} {change:+.0%}" for key, change in changes.items())
+                if any(change > tolerance for change in changes.values()):
+                    line += "  ⚠ RÉGRESSION"
+                    regressions += 1
+            click.echo(line)
+
+    if save_path:
+        import platform
+        import reportlab
+        with open(save_path, "w") as f:
+            json.dump({"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                       "reportlab": reportlab.Version, "machine": platform.machine(), "repeat": repeat, "cold": cold,
+                       "results": results}, f, indent=2)
+        click.echo(f"Référence enregistrée dans {save_path}")
+    if regressions:
+        click.echo(f"{regressions} cas en régression (tolérance {tolerance:.0%})")
+        raise SystemExit(1)
+
+@app.cli.command("bench-cartes")
+@click.option("--repeat", default=50, show_default=True, help="Rendus mesurés par cas (médiane)")
+@click.option("--cold", is_flag=True, help="Vider les caches de rendu avant chaque rendu")
+def bench_cartes_command(repeat, cold):
+    """Compare le rendu groupé des trois parties de la carte à trois rendus séparés, sans MongoDB.
+
+    Les rendus séparés correspondent aux trois soumissions du formulaire
+    nécessaires auparavant (hors requêtes HTTP et insertions MongoDB évitées).
+    """
+    import statistics
+    from contextlib import redirect_stdout
+
+    load_pdf_stack()
+    carte = next(args for generator, _, args in bench_payloads([0], {}) if generator == "carte_complete")[0]
+
+    def separate():
+        sizes = []
+        for partie in CARTE_PARTIES:
+            pdf_file = PDF_GENERATORS[f"carte_{partie}"](dict(carte), "0123456789abcdef01234567")
+            sizes.append(pdf_file.seek(0, io.SEEK_END))
+            pdf_file.close()
+        return sum(sizes)
+
+    def grouped():
+        archive_file = generate_cartes_identification(dict(carte), "0123456789abcdef01234567")
+        size = archive_file.seek(0, io.SEEK_END)
+        archive_file.close()
+        return size
+
+    cases = {"3 rendus séparés": separate, "rendu groupé (ZIP)": grouped}
+    timings = {name: [] for name in cases}
+    sizes = {}
+    with redirect_stdout(io.StringIO()):
+        for render in cases.values():
+            render()  # premier rendu : chargement de ReportLab, styles et blocs fixes
+        # Mesures alternées pour que les deux cas subissent les mêmes variations de charge
+        for _ in range(repeat):
+            for name, render in cases.items():
+                if cold:
+                    _reset_render_caches()
+                started = time.perf_counter()
+                sizes[name] = render()
+                timings[name].append(time.perf_counter() - started)
+
+    reference = statistics.median(timings["3 rendus séparés"])
+    click.echo(f"{'cas':<22}{'temps ms':>10}{'écart':>8}{'Ko':>8}")
+    for name, values in timings.items():
+        median = statistics.median(values)
+        click.echo(f"{name:<22}{median * 1000:>10.1f}{median / reference - 1:>+8.0%}{sizes[name] / 1024:>8.1f}")
+    click.echo("Requêtes : 3 -> 1, insertions cartes_identification : 3 -> 1")
+
 # ==================== LANCEMENT DE L'APPLICATION ====================
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+# Configuration gunicorn (chargée automatiquement depuis le dossier courant,
+# ou explicitement avec : gunicorn -c gunicorn.conf.py app:app)
+#
+# preload_app charge app.py (et, via when_ready, ReportLab et Pillow) une seule
+# fois dans le processus maître : les workers sont ensuite créés par fork, plus vite et en
+# partageant la mémoire de ces modules. C'est sans risque pour MongoDB car
+# app.py ne crée aucun MongoClient à l'import : get_db() ouvre un client par
+# processus à sa première utilisation, après le fork. Seul MONGO_ENSURE_INDEXES
+# utilise la base dans le maître (via when_ready, une fois, au lieu d'une fois par
+# worker) ; ce client reste dans le maître et n'est jamais réutilisé par les workers.
+# Sans préchargement, le maître n'importe pas app.py : utiliser flask ensure-indexes.
+#
+# Les valeurs se règlent par variables d'environnement :
+#   PORT                  port d'écoute (fourni par Render)
+#   WEB_CONCURRENCY       nombre de workers (défaut : 1, comme gunicorn)
+#   GUNICORN_THREADS      threads par worker (worker gthread si > 1)
+#   GUNICORN_TIMEOUT      délai maximal d'une requête, en secondes (défaut : 30)
+#   GUNICORN_PRELOAD      0 pour désactiver le préchargement
+#   GUNICORN_MAX_REQUESTS requêtes avant recyclage d'un worker (défaut : 0, jamais)
+#
+# Le pool MongoDB est par worker : MONGO_MAX_POOL_SIZE x WEB_CONCURRENCY
+# connexions au plus, à garder sous la limite du cluster.
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Chaque worker charge ReportLab, ouvre son pool MongoDB et, en rendu asynchrone
+# ou export, démarre PDF_JOB_WORKERS processus de rendu : on garde le défaut de gunicorn
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Recyclage des workers (désactivé par défaut, comme dans gunicorn)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+
+def when_ready(server):
+    # Avec le préchargement, ReportLab et Pillow (importés sinon au premier rendu
+    # de chaque worker) sont chargés une fois dans le maître et partagés par fork.
+    if server.cfg.preload_app and "app" in sys.modules:
+        sys.modules["app"].load_pdf_stack()
+    # Index MongoDB (MONGO_ENSURE_INDEXES) : créés ici une seule fois, pas à l'import
+    if "app" in sys.modules:
+        sys.modules["app"].ensure_indexes_at_startup()
+
+
+def worker_exit(server, worker):
+    # Écrit les dernières métriques du worker (recyclage, arrêt) avant sa sortie
+    if "app" in sys.modules:
+        sys.modules["app"].flush_metrics()
+
+
+def post_fork(server, worker):
+    # Rien à réinitialiser : le client MongoDB, les pools de rendu et le
+    # nettoyage périodique sont créés à la demande dans chaque worker.
+    server.log.info("Worker %s démarré (pid %s)", worker.age, worker.pid)